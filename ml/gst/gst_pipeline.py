@@ -107,7 +107,8 @@ class GSTPipeline(Thread):
         self.pipeline = None
         self.loop = None
 
-        self.queue = Dequeue(maxlen=max_buffer) # Queue(maxsize=max_buffer)
+        # Frames only to evict on overflow not to lose EOS/ERROR
+        self.queue = Dequeue(maxlen=max_buffer, evictable=lambda item: item[0] == MESSAGE_TYPE.FRAME) # Queue(maxsize=max_buffer)
         self.queue_timeout = queue_timeout
 
         self.setup()
@@ -212,6 +213,54 @@ class RTSPPipeline(GSTPipeline):
     def __init__(self, cfg, name=None, max_buffer=100, queue_timeout=10, daemon=True):
         super().__init__(cfg, name, max_buffer, queue_timeout, daemon)
         self._video_caps = None
+        self._batches = []
+        self._batch = 0
+
+    def read_batch(self, n, out=None):
+        """
+        Read up to n frames into slices of a contiguous batch array.
+        Params:
+            n: max number of frames to read
+            out: (N, H, W, C) array with N >= n or reuse one of two pooled arrays
+        Returns:
+            tuple(message_type: MESSAGE_TYPE, frames: np.ndarray | Exception, meta: dict | None)
+            frames: out[:k] of k frames read with meta arrays of timestamp, pts and duration in secs
+        Raises:
+            TimeoutError
+        """
+        meta = dict(
+            timestamp=np.zeros(n, dtype=np.float64),
+            pts=np.zeros(n, dtype=np.int64),
+            duration=np.zeros(n, dtype=np.float64),
+        )
+        k = 0
+        while k < n:
+            try:
+                message_type, message = self.read()
+            except TimeoutError as e:
+                if k == 0:
+                    raise e
+                break
+            if message_type != MESSAGE_TYPE.FRAME:
+                if k == 0:
+                    return message_type, message, None
+                # EOS/ERROR to read next unless the queue is refilled with newer frames
+                if not self.queue.putleft((message_type, message)):
+                    logging.warning(f"Dropped {message_type} behind a full queue")
+                break
+            data = message.data
+            if out is None:
+                shape = (n, *data.shape)
+                if not self._batches or self._batches[0].shape != shape or self._batches[0].dtype != data.dtype:
+                    self._batches = [np.empty(shape, dtype=data.dtype) for _ in range(2)]
+                out = self._batches[self._batch]
+                self._batch = (self._batch + 1) % len(self._batches)
+            np.copyto(out[k], data)
+            meta['timestamp'][k] = message.timestamp
+            meta['pts'][k] = message.pts
+            meta['duration'][k] = message.duration / Gst.SECOND
+            k += 1
+        return MESSAGE_TYPE.FRAME, out[:k], {key: value[:k] for key, value in meta.items()}
 
     def on_new_sample(self, sink, udata):
         """Callback on 'new-sample' signal"""
@@ -1,3 +1,4 @@
 from .version import __version__
 from .avsource import AVSource
+from .multi import MultiSourceReader
 from .producers import *
\ No newline at end of file
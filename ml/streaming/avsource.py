@@ -7,18 +7,302 @@
 
 import os
 import time
+import asyncio
+from base64 import b64encode, b64decode
+from functools import partial
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from time import localtime, strftime
 
+import numpy as np
+
 from ml import av, logging
-from ml.av import NALU_t, NALUParser, hasStartCode
+from ml.av import NALU_t, hasStartCode
+from .cache import Cache, host_key, stream_key
+from .index import load_index
+from .jitter import JitterBuffer
+from .nalu import HEVC, HEVC_NALU_t, HEVC_VCL_NALUS, PARAMETER_SETS, nalu_types, scan_nalus, split_nalus, rewrite_packet, is_avcc, parse_avcc, parse_hvcc, avcc_to_annexb
+from .parallel import ParallelDecoder
+from .prefetch import Prefetcher
+from .ring import PacketRing, export_clip
+from .session import Session, VideoState, AudioState
+from .snapshot import SnapshotCache
+from .threads import THREADS, configure
+from .video import INTRA_CODECS, FramePool, Converter, ChangeGate, MotionGrid, DecodePolicy
 
 obj_type = type
 
+# NALUs to pass through in the steady state
+STREAM_NALUS = (NALU_t.AUD, NALU_t.SEI, NALU_t.SPS, NALU_t.PPS, NALU_t.IDR, NALU_t.NIDR)
+HEVC_STREAM_NALUS = (HEVC_NALU_t.AUD, HEVC_NALU_t.PREFIX_SEI, HEVC_NALU_t.SUFFIX_SEI, HEVC_NALU_t.VPS, HEVC_NALU_t.SPS, HEVC_NALU_t.PPS) + HEVC_VCL_NALUS
+
+# RTSP transports to race in case unspecified
+RTSP_TRANSPORTS = ('tcp', 'http')
+
+# Last successful RTSP transport per host
+TRANSPORTS = Cache('rtsp_transports', ttl=24 * 60 * 60)
+
+# Stream parameters per source URL to reopen with minimal probing
+PARAMS = Cache('stream_params', ttl=7 * 24 * 60 * 60)
+
+# Minimal probing options given cached stream parameters
+FAST_PROBING = dict(
+    probesize='32768',              # bytes
+    analyzeduration='500000',       # us
+)
+
+def stream_params(stream, fps):
+    '''Stream parameters discovered by probing to cache.
+    '''
+    codec = stream.codec_context
+    return dict(
+        codec=codec.name,
+        extradata=codec.extradata and b64encode(codec.extradata).decode() or None,
+        width=stream.width,
+        height=stream.height,
+        fps=fps,
+        time_base=str(stream.time_base),
+    )
+
+def match_params(stream, params):
+    '''Whether the stream probed minimally is consistent with the cached parameters.
+    '''
+    codec = stream.codec_context
+    if codec.name != params['codec']:
+        return False
+    if stream.width and (stream.width, stream.height) != (params['width'], params['height']):
+        return False
+    if stream.time_base is not None and str(stream.time_base) != params['time_base']:
+        return False
+    return True
+
+def replay_speed(replay):
+    '''Replay speed factor of a non-real-time source or None to read as fast as possible.
+
+    Args:
+        replay(str | float): realtime | max | speed factor
+    '''
+    if replay == 'realtime':
+        return 1.0
+    elif replay == 'max':
+        return None
+    speed = float(replay)
+    if speed <= 0:
+        raise ValueError(f"Replay speed must be positive: {replay}")
+    return speed
+
+# Reconnection backoff and max outage in secs to give up
+RECONNECT = dict(
+    delay=0.5,
+    backoff=2,
+    max_delay=8,
+    outage=60,
+)
+
+def reconnect_policy(reconnect):
+    '''Reconnection policy from a session option of None, True for defaults or a dict overriding RECONNECT.
+    '''
+    if not reconnect:
+        return None
+    return dict(RECONNECT) if reconnect is True else dict(RECONNECT, **reconnect)
+
+def openRTSP(src, transports, options, timeout=(15, 5), attempts=None):
+    '''Open an RTSP source over the transports concurrently with the first success winning.
+
+    Args:
+        src(str): RTSP URL
+        transports(List[str]): rtsp_transport options to attempt
+        options(dict): other ffmpeg RTSP options
+        timeout(Tuple[float, float]): av.open() timeout to open and read
+        attempts(dict): optional attempts by transport to record the start wall clock, secs to open or fail and error
+    Returns:
+        transport(str): the winning transport
+        source(av.InputContainer): the opened source
+    '''
+    attempts = {} if attempts is None else attempts
+    def attempt(transport):
+        start = time.time()
+        attempts[transport] = record = dict(start=start, open=None, failed=None, error=None)
+        try:
+            source = av.open(src, options=dict(options, rtsp_transport=transport), timeout=timeout)
+        except Exception as e:
+            record.update(failed=time.time() - start, error=str(e))
+            logging.warning(f"Failed with rtsp_transport={transport} in {record['failed']:.3f}s: {e}")
+            raise e
+        record['open'] = time.time() - start
+        logging.info(f"Opened with rtsp_transport={transport} in {record['open']:.3f}s")
+        return transport, source
+
+    if len(transports) == 1:
+        return attempt(transports[0])
+
+    def close(future):
+        if future.exception() is None:
+            transport, source = future.result()
+            logging.info(f"Closing the losing rtsp_transport={transport}")
+            source.close()
+
+    executor = ThreadPoolExecutor(len(transports), thread_name_prefix='openRTSP')
+    futures = [executor.submit(attempt, transport) for transport in transports]
+    winner = None
+    for future in as_completed(futures):
+        if future.exception() is None:
+            winner = future
+            break
+    for future in futures:
+        if future is not winner:
+            future.add_done_callback(close)
+    executor.shutdown(wait=False)
+    if winner is None:
+        failed = ', '.join(f"{transport} in {attempts[transport]['failed']:.3f}s" for transport in transports if transport in attempts)
+        raise ConnectionError(f"Failed to open RTSP source over {'/'.join(transports)}: {failed}")
+    return winner.result()
+
+def seekAV(session, t):
+    '''Seek a local video session to the nearest key frame at or before t secs from the beginning.
+
+    The keyframe index is loaded from the sidecar or built once by a demux pass.
+    Key frames are timed by packet count at the session FPS as frames are read.
+    Frames read next are timed and counted from the key frame.
+    '''
+    meta = session['video']
+    index = meta.get('index', None)
+    if index is None:
+        index = meta['index'] = load_index(session['src'])
+    fps = meta['fps']
+    i = index.locate(t, fps)
+    pts, count = index.pts[i], int(index.count[i])
+    ktime = count / fps
+
+    framer = meta.get('framer', None)
+    if framer is not None:
+        framer.close()
+    decoder = meta.get('decoder', None)
+    if decoder is not None:
+        decoder.reset()
+    streams = session['streams']
+    if pts is None:
+        # XXX raw bitstreams are not seekable by timestamp: reopen to skip packets without decoding
+        streams.close()
+        session['streams'] = streams = av.open(session['src'])
+        stream = streams.demux(video=0)
+        for _ in range(count):
+            next(stream)
+    else:
+        streams.seek(pts, stream=streams.streams.video[0], backward=True, any_frame=False)
+        stream = streams.demux(video=0)
+    codec = meta['codec']
+    if session['decoding'] and hasattr(codec, 'flush_buffers'):
+        codec.flush_buffers()
+
+    origin = session.setdefault('origin', session['start'])
+    session['start'] = origin + ktime
+    meta.update(
+        stream=stream,
+        framer=None,
+        prev=None,
+        count=count,
+        time=session['start'],
+    )
+    logging.info(f"Seeked to key frame[{count}] at {ktime:.3f}s for {t:.3f}s")
+    return ktime
+
+def renewDecoder(session):
+    '''Replace the video decoder of a session at a key frame to take its rebalanced decoder threads.
+
+    Frames delayed in the previous decoder if any are dropped.
+
+    Returns:
+        new decoder configured the same but threading
+    '''
+    meta = session['video']
+    codec = meta['codec']
+    decoder = av.CodecContext.create(codec.name, 'r')
+    if codec.extradata is not None:
+        decoder.extradata = codec.extradata
+    decoder.options = dict(codec.options or {})
+    meta['policy'].setup(decoder)
+    THREADS.apply(meta['threads'], decoder)
+    dropped = len(codec.decode(None))
+    meta['codec'] = decoder
+    logging.info(f"Renewed the decoder with {decoder.thread_count} {decoder.thread_type} threads, dropping {dropped} delayed frames")
+    return decoder
+
+def reconnectAV(session, error=None):
+    '''Reconnect a dropped real-time network session in place with exponential backoff.
+
+    The new connection is opened with minimal probing to reuse the codec context and CPD.
+    Packets are then skipped through the next key frame with pts rebased to continue the timeline.
+
+    Returns:
+        demuxer of the new connection
+    Raises:
+        ConnectionError: if not reconnected within the max outage
+    '''
+    meta = session['video']
+    policy = meta['reconnect']
+    stats = meta['stats']['reconnect']
+    dropped = time.time()
+    logging.warning(f"Reconnecting to {session['src']} on {error}")
+    jitter = meta['jitter']
+    if jitter is not None:
+        jitter.close()
+    decoder = meta.get('decoder', None)
+    if decoder is not None:
+        decoder.reset()
+    try:
+        session['streams'].close()
+    except Exception as e:
+        logging.warning(f"Failed to close the dropped connection: {e}")
+
+    reopen = session['reopen']
+    options = dict(reopen['options'] or {}, **FAST_PROBING)
+    delay = policy['delay']
+    while True:
+        stats['attempts'] += 1
+        try:
+            source = av.open(session['src'], format=reopen['format'], options=options, timeout=(15, 5))
+            if not source.streams.video:
+                source.close()
+                raise ValueError(f"No video stream")
+        except Exception as e:
+            elapsed = time.time() - dropped
+            if elapsed + delay > policy['outage']:
+                stats['failures'] += 1
+                raise ConnectionError(f"Failed to reconnect to {session['src']} in {elapsed:.3f}s: {e}") from e
+            logging.warning(f"Failed to reconnect in {elapsed:.3f}s, retrying in {delay:.3f}s: {e}")
+            time.sleep(delay)
+            delay = min(delay * policy['backoff'], policy['max_delay'])
+        else:
+            break
+
+    stream = source.demux(video=0)
+    if jitter is not None:
+        stream = jitter = JitterBuffer(stream, seconds=jitter.seconds, size=jitter.size, fps=meta['fps'])
+        meta['stats']['jitter'] = jitter.stats
+    session['streams'] = source
+    meta.update(
+        stream=stream,
+        jitter=jitter,
+        resync=dropped,
+    )
+    stats['reconnects'] += 1
+    logging.info(f"Reconnected to {session['src']} in {time.time() - dropped:.3f}s, waiting for a key frame")
+    return stream
+
 def openAV(src, decoding=False, with_audio=False, **kwargs):
+    opened = kwargs.get('opened', None) or time.time()
+    prefetch, pool = int(kwargs.get('prefetch', 0)), int(kwargs.get('pool', 0) or 0)
+    if prefetch > 0 and 0 < pool < prefetch + 2:
+        # Queued frames plus the one the worker is putting and the one the consumer is reading
+        raise ValueError(f"pool={pool} overwrites prefetched frames: at least prefetch + 2 = {prefetch + 2} required")
+    key = isinstance(src, str) and stream_key(src) or None
+    cached = key and kwargs.get('fast_start', True) and PARAMS.get(key) or None
+    probing = cached and FAST_PROBING or {}
     try:
         format = None
         options = None
+        rtsp = None
         fps = float(kwargs.get('fps', 10))
         if str(src).startswith('rtsp'):
             # ffmpeg RTSP options:
@@ -27,25 +311,34 @@ def openAV(src, decoding=False, with_audio=False, **kwargs):
             # allowed_media_types: video, audio, data
             # stimeout: socket TCP I/O timeout in us
             # RTSP/HTTP required for VPN but not necessarily supported
-            options = dict(rtsp_transport=kwargs.get('rtsp_transport', 'tcp'),
-                           rtsp_flags='prefer_tcp',
-                           stimeout=kwargs.get('stimeout', '5000000')) # in case of network down
+            options = dict(rtsp_flags='prefer_tcp',
+                           stimeout=kwargs.get('stimeout', '5000000'), # in case of network down
+                           **probing)
 
-            # NOTE: retry with different rtsp transport types if unspecified
-            if options and options.get('rtsp_transport', None):
+            # NOTE: race different rtsp transport types if unspecified
+            transport = kwargs.get('rtsp_transport', None)
+            attempts = {}
+            if transport:
+                transport, source = openRTSP(src, [transport], options, attempts=attempts)
+            else:
+                host = host_key(src)
+                transport = TRANSPORTS.get(host)
                 source = None
-                for transport in ['tcp', 'http']:
+                if transport:
                     try:
-                        options['rtsp_transport'] = transport
-                        source = av.open(src, format=format, options=options, timeout=(15, 5))
+                        transport, source = openRTSP(src, [transport], options, attempts=attempts)
                     except Exception as e:
-                        logging.warning(f'Failed with rtsp_transport={transport}: {e}')
-                    else:
-                        options['rtsp_transport'] = transport
-                        break
-                assert source is not None, f"Failed to open RTSP source over TCP/HTTP"
-            else:
-                source = av.open(src, format=format, options=options, timeout=(15, 5))
+                        logging.warning(f"Cached rtsp_transport={transport} failed for {host}: {e}")
+                        TRANSPORTS.pop(host)
+                if source is None:
+                    transport, source = openRTSP(src, RTSP_TRANSPORTS, options, attempts=attempts)
+                    TRANSPORTS.set(host, transport)
+            options['rtsp_transport'] = transport
+            rtsp = dict(
+                transport=transport,
+                attempts=attempts,
+                ttfp=None,                      # secs from the winning attempt to the first video packet
+            )
         else:
             if isinstance(src, int) or (isinstance(src, str) and src.startswith('/dev/video')):
                 # XXX webcam: high FPS with MJPG
@@ -61,6 +354,8 @@ def openAV(src, decoding=False, with_audio=False, **kwargs):
                     src = f"/dev/video{src}" if isinstance(src, int) else src
                 else:
                     raise ValueError(f"Webcam unsupported on {system}")
+            elif probing:
+                options = dict(probing)
             source = av.open(src, format=format, options=options)
 
         # timeout: maximum timeout (in secs) to wait for incoming connections and soket reading
@@ -71,10 +366,11 @@ def openAV(src, decoding=False, with_audio=False, **kwargs):
         raise e
     else:
         '''
-        H.264 NALU formats:
+        H.264/H.265 NALU formats:
         Annex b.: 
             RTSP/RTP: rtsp, 'RTSP input', set()
             bitstream: h264, 'raw H.264 video', {'h26l', 'h264', '264', 'avc'}
+            bitstream: hevc, 'raw HEVC video', {'hevc', 'h265', '265'}
             webcam: /dev/videoX, ...
             DeepLens: /opt/.../...out
             NUUO/NVR: N/A
@@ -84,6 +380,14 @@ def openAV(src, decoding=False, with_audio=False, **kwargs):
             webm/mkv: 'matroska,webm', 'Matroska / WebM', {'mks', 'mka', 'mkv', 'mk3d'}
             DASH/KVS(StreamBody): file-like obj
         '''
+        if cached:
+            if not source.streams.video or not match_params(source.streams.video[0], cached):
+                logging.warning(f"Stream inconsistent with cached parameters {cached}, reopening with full probing")
+                source.close()
+                PARAMS.pop(key)
+                return openAV(src, decoding, with_audio, **dict(kwargs, fast_start=False, opened=opened))
+            logging.info(f"Opened with minimal probing given cached parameters: {cached}")
+
         now = time.time()
         start_time = source.start_time / 1e6 # us
         relative = abs(start_time - now) > 60*60*24*30          # Too small to be absolute
@@ -94,13 +398,15 @@ def openAV(src, decoding=False, with_audio=False, **kwargs):
             logging.info(f"Simulating local source as real-time: {src}")
 
         # XXX start_time may be negative (webcam), zero if unavailable, or a small logical timestamp
-        session = dict(
+        session = Session(
             src=src,
             streams=source,
             format=source.format.name,
             decoding=decoding,
             start=relative and now or start_time,
             rt=rt,
+            opened=opened,                      # wall clock to open
+            reopen=dict(format=format, options=options),
         )
         session_start_local = strftime('%X', localtime(session['start']))
         source_start_local = strftime('%X', localtime(start_time))
@@ -109,15 +415,55 @@ def openAV(src, decoding=False, with_audio=False, **kwargs):
             # FIXME RTSP FPS might be unavailable or incorrectly set
             video0 = source.streams.video[0] 
             codec = video0.codec_context
-            FPS = 1 / (codec.time_base * codec.ticks_per_frame)
-            fps = FPS > 60 and (codec.framerate and float(codec.framerate)) or fps
-            session['video'] = dict(
-                stream=source.demux(video=0),
+            if cached:
+                # XXX minimal probing may miss out of band CPD, resolution and FPS
+                if codec.extradata is None and cached['extradata']:
+                    codec.extradata = b64decode(cached['extradata'])
+                FPS = fps = cached['fps']
+                vwidth, vheight = video0.width or cached['width'], video0.height or cached['height']
+            else:
+                FPS = 1 / (codec.time_base * codec.ticks_per_frame)
+                fps = FPS > 60 and (codec.framerate and float(codec.framerate)) or fps
+                vwidth, vheight = video0.width, video0.height
+                if key:
+                    PARAMS.set(key, stream_params(video0, fps))
+            converter = Converter(scale=kwargs.get('scale', None), roi=kwargs.get('roi', None), pool=kwargs.get('pool', 0))
+            policy = DecodePolicy(kwargs.get('decode', 'all'), n=kwargs.get('every', 1), target_fps=kwargs.get('target_fps', None))
+            gate = ChangeGate.create(kwargs.get('gate', None))
+            mvgrid = decoding and MotionGrid.create(kwargs.get('motion', None)) or None
+            ring = PacketRing.create(kwargs.get('ring', None))
+            snapshots = SnapshotCache.create(kwargs.get('snapshots', None))
+            avcc = None
+            if not decoding and kwargs.get('annexb', True) and codec.name in PARAMETER_SETS and is_avcc(codec.extradata):
+                # Passthrough AVCC/HVCC packets converted to Annex B with parameter sets on key frames
+                avcc = (*(parse_hvcc if codec.name in HEVC else parse_avcc)(codec.extradata), codec.name)
+            if snapshots is not None:
+                snapshots.setup(codec.name, avcc is None and codec.extradata or None)
+            decoder = None
+            threads = None
+            if decoding:
+                policy.setup(codec)
+                if mvgrid is not None:
+                    mvgrid.setup(codec)
+                decoders = int(kwargs.get('decoders', 1) or 1)
+                if decoders > 1 and mvgrid is None and codec.name in INTRA_CODECS:
+                    # Independent frames decoded by a thread pool in order
+                    decoder = ParallelDecoder(codec, decoders, scale=kwargs.get('scale', None), roi=kwargs.get('roi', None))
+                elif kwargs.get('threads', None) is True:
+                    # Slice threads to decode in step with packets
+                    threads = THREADS.register(codec, vwidth, vheight, fps)
+                elif kwargs.get('threads', None):
+                    configure(codec, int(kwargs['threads']))
+            width, height = decoding and converter.geometry(vwidth, vheight) or (vwidth, vheight)
+            stream = source.demux(video=0)
+            jitter = rt and JitterBuffer.create(stream, kwargs.get('jitter', None), fps=fps) or None
+            session['video'] = VideoState(
+                stream=jitter or stream,
                 start=video0.start_time,        # same as 1st frame in pts
                 codec=codec,
                 format=video0.name,
-                width=video0.width,
-                height=video0.height,
+                width=width,
+                height=height,
                 fps=fps,
                 count=0,
                 time=0,                         # pts in secs
@@ -129,6 +475,44 @@ def openAV(src, decoding=False, with_audio=False, **kwargs):
                     drifting=10,
                 ),
                 prev=None,
+                prefetch=int(kwargs.get('prefetch', 0)),
+                replay=replay_speed(kwargs.get('replay', 'realtime')),
+                end=None,                       # frame time to stop at
+                anchor=None,                    # (wall clock, frame time) to pace replay from
+                converter=converter,
+                sink=None,                      # output array to convert the next frame into
+                policy=policy,
+                decoder=decoder,                # parallel decoder of intra-only frames
+                threads=threads,                # key in the process-wide decoder thread budget
+                gate=gate,
+                mvgrid=mvgrid,
+                motion=None,                    # grid of mean motion vector magnitudes of the frame
+                ring=ring,
+                snapshots=snapshots,
+                jitter=jitter,
+                reconnect=key and reconnect_policy(kwargs.get('reconnect', None)) or None,
+                resync=None,                    # wall clock of the drop to skip through the next key frame
+                offset=0,                       # pts offset to continue the timeline across reconnections
+                cpd=None,                       # out of band CPD in Annex B
+                avcc=avcc,                      # (length_size, CPD, codec) to convert AVCC/HVCC packets to Annex B
+                stats=dict(
+                    decode=policy.stats,
+                    gate=gate and gate.stats or None,
+                    ring=ring and ring.stats or None,
+                    jitter=jitter and jitter.stats or None,
+                    reconnect=dict(
+                        reconnects=0,
+                        attempts=0,
+                        failures=0,
+                        skipped=0,              # packets skipped through the key frame
+                        latency=None,           # secs from the last drop to the key frame
+                        max_latency=0,
+                    ),
+                    open=now - opened,          # secs to open the source
+                    rtsp=rtsp,                  # RTSP transport attempts
+                    probing=cached and 'fast' or 'full',
+                    ttff=None,                  # secs to the first frame from opening
+                ),
             )
             logging.info(f"codec.framerate={codec.framerate}, codec.time_base={codec.time_base}, codec.ticks_per_frame={codec.ticks_per_frame}, fps={session['video']['fps']}, FPS={FPS}")
         if source.streams.audio:
@@ -139,7 +523,7 @@ def openAV(src, decoding=False, with_audio=False, **kwargs):
             if codec.name == 'aac':
                 logging.warning(f"AAC is not supported yet")
             else:
-                session['audio'] = dict(
+                session['audio'] = AudioState(
                     stream=decoding and source.decode(audio=0) or source.demux(audio=0),
                     start=audio0.start_time,        # same as 1st frame in pts
                     format=audio0.name,
@@ -150,6 +534,12 @@ def openAV(src, decoding=False, with_audio=False, **kwargs):
                     time=0,
                 )
             '''
+        if not rt and 'video' in session:
+            start, end = kwargs.get('start', None), kwargs.get('end', None)
+            if end is not None:
+                session['video']['end'] = session['start'] + end
+            if start:
+                seekAV(session, start)
         return session
 
 class AVSource(object):
@@ -158,8 +548,13 @@ class AVSource(object):
     Each time open() returns one or more streaming sessions.
     It is the caller's responsibility to manage the returned sessions.
     A specific session is required to read frames from the source.
+
+    The async APIs aopen(), aread(), aiter() and aclose() run the blocking
+    counterparts in `executor` or the default executor of the running loop.
     '''
 
+    executor = None
+
     @classmethod
     def create(cls, url, *args, **kwargs):
         '''Generic source creation by url.
@@ -227,14 +622,62 @@ class AVSource(object):
         KWArgs:
             fps(int): framerate for webcam
             resolution(str): resolution for webcam
+            rtsp_transport(str): RTSP transport to use or race tcp and http with the winner cached per host
+            fast_start(bool): reopen RTSP/HTTP sources with minimal probing given cached stream parameters
+            replay(str | float): realtime | max | speed factor to read a local file
+            start(float): secs to seek a local file to the nearest key frame before
+            end(float): secs to stop reading a local file at
+            prefetch(int): max frames to demux and decode ahead in a worker thread or 0 to read on demand
+            pool(int): number of preallocated output arrays to reuse round robin or 0 to allocate per frame, at least prefetch + 2 if prefetching
+            scale(Tuple[int, int]): decoded frame (H, W) to scale to
+            roi(Tuple[int, int, int, int]): decoded frame (x, y, w, h) to crop before scaling
+            decode(str): decode policy of all | keyframes | every_n | target_fps
+            every(int): emit every n-th frame to decode by every_n
+            target_fps(float): max FPS to decode by target_fps
+            gate(bool | dict): suppress static frames by luma change of threshold, size and max_gap
+            motion(bool | Tuple[int, int]): export motion vectors to summarize in meta['motion'] as a (rows, cols) grid
+            ring(bool | dict): keep encoded packets of the last seconds within size bytes to export clips
+            snapshots(bool | dict): keep the latest key frame or those of the last seconds to serve snapshots
+            reconnect(bool | dict): reconnect RTSP/HTTP sources in place on drops by delay, backoff, max_delay and max outage secs
+            threads(bool | int): share the process-wide decoder thread budget or decode by a fixed number of threads
+            decoders(int): number of threads to decode intra-only video such as MJPEG from webcams in parallel
+            jitter(bool | dict): buffer network packets by a worker thread to prefill seconds within size bytes and pace the playout
+            annexb(bool): convert H.264/H.265 packets from MP4/MKV/DASH in AVCC/HVCC to Annex B if not decoding
         """
         return openAV(self.src, *args, **kwargs)
     
     def close(self, session):
+        for media in ('video', 'audio'):
+            framer = session.get(media, {}).get('framer', None)
+            if isinstance(framer, Prefetcher):
+                framer.close()
+                if media == 'video' and 'streams' in framer.shadow:
+                    # Take over the connection and jitter buffer the worker may have replaced on reconnecting
+                    session['streams'] = framer.shadow['streams']
+                    session['video']['jitter'] = framer.shadow['video'].get('jitter', None)
+        jitter = session.get('video', {}).get('jitter', None)
+        if jitter is not None:
+            jitter.close()
+        decoder = session.get('video', {}).get('decoder', None)
+        if decoder is not None:
+            decoder.close()
+        threads = session.get('video', {}).get('threads', None)
+        if threads is not None:
+            THREADS.unregister(threads)
         if 'streams' in session:
             session['streams'].close()
         session.clear()
 
+    def seek(self, session, t):
+        '''Seek a local video session to the nearest key frame at or before t secs.
+
+        Returns:
+            secs of the key frame seeked to
+        '''
+        if session['rt']:
+            raise ValueError(f"Real-time source not seekable: {session['src']}")
+        return seekAV(session, t)
+
     def read_audio(self, session):
         meta = session['audio']
         stream = meta['stream']
@@ -252,38 +695,82 @@ class AVSource(object):
         return None
 
     def read_video(self, session, format='BGR'):
-        meta = session['video']
-        stream = meta['stream']
-        codec = meta['codec']
-        workaround = meta['workaround']
+        meta = session.video
+        stream = meta.stream
+        codec = meta.codec
+        workaround = meta.workaround
+        # H.264 or H.265 NALU types and parameter sets of the CPD in order
+        NALU_T = nalu_types(codec.name)
+        psets = PARAMETER_SETS['hevc' if codec.name in HEVC else 'h264']
+        stream_nalus = codec.name in HEVC and HEVC_STREAM_NALUS or STREAM_NALUS
         while True:
             try:
                 pkt = next(stream)
             except StopIteration:
                 pkt = None
+            except Exception as e:
+                if meta.reconnect is None:
+                    raise e
+                stream = reconnectAV(session, e)
+                continue
             now = time.time()
-            prev = meta.get('prev', None)
+            prev = meta.prev
+            if meta.reconnect is not None:
+                if pkt is None or pkt.size == 0:
+                    stream = reconnectAV(session, 'EOS')
+                    continue
+                if meta.resync is not None:
+                    stats = meta.stats['reconnect']
+                    if not pkt.is_keyframe:
+                        stats['skipped'] += 1
+                        continue
+                    if prev is not None and prev.pts is not None and pkt.pts is not None and prev.time_base and pkt.time_base:
+                        # Continue the timeline from the previous frame across the outage
+                        resume = prev.pts * prev.time_base + max(now - meta.time, 1.0 / meta.fps)
+                        meta.offset = round(resume / pkt.time_base) - pkt.pts
+                    if meta.cpd and not (scan_nalus(pkt, codec=codec.name)['type'] == psets[0]).any():
+                        pkt = rewrite_packet(pkt, [memoryview(pkt)], meta.cpd)
+                    stats['latency'] = now - meta.resync
+                    stats['max_latency'] = max(stats['max_latency'], stats['latency'])
+                    meta.resync = None
+                    logging.info(f"Resumed at a key frame in {stats['latency']:.3f}s from the drop")
+                if meta.offset and pkt.pts is not None:
+                    pkt.pts += meta.offset
+                    if pkt.dts is not None:
+                        pkt.dts += meta.offset
             if prev is None:
+                rtsp = meta.stats.get('rtsp', None)
+                if rtsp is not None and rtsp['ttfp'] is None:
+                    rtsp['ttfp'] = now - rtsp['attempts'][rtsp['transport']]['start']
+                    logging.info(f"Time to first packet over rtsp_transport={rtsp['transport']}: {rtsp['ttfp']:.3f}s")
                 if not pkt.is_keyframe:
                     # Some RTSP source may not send key frame to begin with e.g. wisecam
                     logging.warning(f"No key frame to begin with, skip through")
-                    session['start'] = now
+                    session.start = now
                     continue
-                meta['keyframe'] = pkt.is_keyframe
-                meta['time'] = session['start']
-                streams = session['streams']
-                sformat = session['format']
+                meta.keyframe = pkt.is_keyframe
+                meta.time = session.start
+                meta.anchor = (now, meta.time)
+                streams = session.streams
+                sformat = session.format
+                annexb = 'hls' in sformat or 'rtsp' in sformat or '264' in sformat or 'hevc' in sformat
                 
-                # XXX Stream container package format determines H.264 NALUs in AVCC or Annex B.
-                # TODO Streaming NALUs in AVCC
-                if 'hls' in sformat or 'rtsp' in sformat or '264' in sformat:
+                # XXX Stream container package format determines H.264/H.265 NALUs in AVCC or Annex B.
+                if meta.avcc is not None:
+                    # AVCC in MP4/MKV/DASH with out of band CPD: parameter sets in avcC/hvcC
+                    logging.info(f"Converting {sformat} AVCC packets to Annex B with CPD({len(meta.avcc[1])})")
+                    pkt = avcc_to_annexb(pkt, *meta.avcc)
+                    annexb = True
+                elif annexb:
                     # XXX In case of out of band CPD: SPS/PPS in AnnexB.
                     CPD = []
                     if codec.extradata is not None:
-                        for (pos, _, _, type), nalu in NALUParser(codec.extradata, workaround=workaround):
+                        extradata = codec.extradata
+                        nalus = scan_nalus(extradata, workaround=workaround, codec=codec.name)
+                        for (pos, _, _, type, _), nalu in zip(nalus.tolist(), map(bytes, split_nalus(extradata, nalus))):
                             if hasStartCode(nalu):
                                 CPD.append(nalu)
-                                logging.info(f"CPD {NALU_t(type).name} at {pos}: {nalu[:8]} ending with {nalu[-1:]}")
+                                logging.info(f"CPD {NALU_T(type).name} at {pos}: {nalu[:8]} ending with {nalu[-1:]}")
                             else:
                                 logging.warning(f"Invalid CPD NALU({type}) at {pos}: {nalu[:8]} ending with {nalu[-1:]}")
                                 if not CPD:
@@ -293,97 +780,105 @@ class AVSource(object):
                     if workaround:
                         # FIXME workaround before KVS MKVGenerator deals with NALUs ending with a zero byte
                         #   https://github.com/awslabs/amazon-kinesis-video-streams-producer-sdk-cpp/issues/491
-                        for (pos, _, _, type), nalu in NALUParser(memoryview(pkt), workaround=workaround):
-                            assert hasStartCode(nalu), f"frame[{meta['count']+1}] NALU(type={type}) at {pos} without START CODE: {nalu[:8].tobytes()}"
-                            if type in (NALU_t.SPS, NALU_t.PPS):
+                        nalus = scan_nalus(pkt, workaround=workaround, codec=codec.name)
+                        for (pos, _, _, type, _), nalu in zip(nalus.tolist(), split_nalus(pkt, nalus)):
+                            assert hasStartCode(nalu), f"frame[{meta.count+1}] NALU(type={type}) at {pos} without START CODE: {nalu[:8].tobytes()}"
+                            if type in psets:
                                 if CPD:
                                     # NOTE: some streams could have multiple UNSPECIFIED(0) NALUs within a single packet with SPS/PPS
                                     #assert len(CPD) == 2, f"len(CPD) == {len(CPD)}, not 2 for SPS/PPS"
-                                    ordinal = type - NALU_t.SPS
+                                    ordinal = psets.index(type)
                                     if nalu == CPD[ordinal]:
-                                        logging.info(f"frame[{meta['count']+1}] same {NALU_t(type).name}({nalu[:8].tobytes()}) at {pos} as in CPD({CPD[ordinal][:8]})")
+                                        logging.info(f"frame[{meta.count+1}] same {NALU_T(type).name}({nalu[:8].tobytes()}) at {pos} as in CPD({CPD[ordinal][:8]})")
                                     else:
                                         # FIXME may expect the CPD to be inserted in the beginning?
-                                        logging.warning(f"frame[{meta['count']+1}] inconsistent {NALU_t(type).name}({nalu[:8].tobytes()}) at {pos} with CPD({CPD[ordinal][:8]})")
-                                        print(f"CPD {NALU_t(type).name}:", CPD[ordinal])
-                                        print(f"NALU {NALU_t(type).name}:", nalu.tobytes())
+                                        logging.warning(f"frame[{meta.count+1}] inconsistent {NALU_T(type).name}({nalu[:8].tobytes()}) at {pos} with CPD({CPD[ordinal][:8]})")
+                                        print(f"CPD {NALU_T(type).name}:", CPD[ordinal])
+                                        print(f"NALU {NALU_T(type).name}:", nalu.tobytes())
                                         # XXX bitstream may present invalid CPD => replacement with bitstream SPS/PPS
                                         CPD[ordinal] = nalu
                                 else:
                                     NALUs.append(nalu)
-                                    logging.info(f"frame[{meta['count']+1}] {NALU_t(type).name} at {pos}: {nalu[:8].tobytes()} ending with {nalu[-1:].tobytes()}")
+                                    logging.info(f"frame[{meta.count+1}] {NALU_T(type).name} at {pos}: {nalu[:8].tobytes()} ending with {nalu[-1:].tobytes()}")
                             # XXX KVS master is ready to filter out non-VCL NALUs as part of the CPD
                             # elif type in (NALU_t.IDR, NALU_t.NIDR):
-                            elif type in (NALU_t.AUD, NALU_t.SEI, NALU_t.IDR, NALU_t.NIDR):
+                            elif type in stream_nalus:
                                 NALUs.append(nalu)
-                                logging.info(f"frame[{meta['count']+1}] {NALU_t(type).name} at {pos}: {nalu[:8].tobytes()}")
+                                logging.info(f"frame[{meta.count+1}] {NALU_T(type).name} at {pos}: {nalu[:8].tobytes()}")
                             else:
                                 # FIXME may expect CPD to be inserted in the beginning?
-                                logging.warning(f"frame[{meta['count']+1}] skipped unexpected NALU(type={type}) at {pos}: {nalu[:8].tobytes()}")
-                        logging.info(f"{pkt.is_keyframe and 'key ' or ''}frame[{meta['count']}] combining CPD({len(CPD)}) and NALUs({len(NALUs)})")
+                                logging.warning(f"frame[{meta.count+1}] skipped unexpected NALU(type={type}) at {pos}: {nalu[:8].tobytes()}")
+                        logging.info(f"{pkt.is_keyframe and 'key ' or ''}frame[{meta.count}] combining CPD({len(CPD)}) and NALUs({len(NALUs)})")
                     else:
                         NALUs.append(memoryview(pkt))
-                        logging.info(f"{pkt.is_keyframe and 'key ' or ''}frame[{meta['count']}] prepending CPD({len(CPD)})")
-                    packet = av.Packet(bytearray(b''.join(CPD+NALUs)))
-                    packet.dts = pkt.dts
-                    packet.pts = pkt.pts
-                    packet.time_base = pkt.time_base
-                    pkt = packet
+                        logging.info(f"{pkt.is_keyframe and 'key ' or ''}frame[{meta.count}] prepending CPD({len(CPD)})")
+                    pkt = rewrite_packet(pkt, NALUs, CPD)
+                    meta.cpd = CPD
                     if pkt.pts is None:
                         logging.warning(f"Initial packet dts/pts={pkt.dts}/{pkt.pts}, time_base={pkt.time_base}")
                     elif pkt.pts > 0:
                         logging.warning(f"Reset dts/pts of 1st frame from {pkt.pts} to 0")
                         pkt.pts = pkt.dts = 0
-                elif 'dash' in sformat:
-                    # TODO In case of out of band CPD: SPS/PPS in AVCC.
-                    logging.info(f"DASH AVCC extradata: {codec.extradata}")
-                    logging.info(f"pkt[:16]({pkt.is_keyframe}) {memoryview(pkt)[:16].tobytes()}")
             else:
                 keyframe = pkt.is_keyframe
-                logging.debug(f"packet[{meta['count']}] {keyframe and 'key ' or ''}dts/pts={pkt.dts}/{pkt.pts}, time_base={pkt.time_base}, duration={pkt.duration}")
-                if 'hls' in sformat or 'rtsp' in sformat or '264' in sformat:
+                logging.debug(f"packet[{meta.count}] {keyframe and 'key ' or ''}dts/pts={pkt.dts}/{pkt.pts}, time_base={pkt.time_base}, duration={pkt.duration}")
+                if meta.avcc is not None:
+                    pkt = avcc_to_annexb(pkt, *meta.avcc)
+                elif annexb:
                     NALUs = []
                     if workaround:
-                        for (pos, _, _, type), nalu in NALUParser(memoryview(pkt), workaround=workaround):
-                            # assert hasStartCode(nalu), f"frame[{meta['count']+1}] NALU(type={type}) at {pos} without START CODE: {nalu[:8].tobytes()}"
-                            # FIXME KVS master is not ready to take AUD/SEI as part of the CPD
-                            # if type in (NALU_t.SPS, NALU_t.PPS, NALU_t.IDR, NALU_t.NIDR):
-                            if type in (NALU_t.AUD, NALU_t.SEI, NALU_t.SPS, NALU_t.PPS, NALU_t.IDR, NALU_t.NIDR):
-                                NALUs.append(nalu)
-                                logging.debug(f"frame[{meta['count']+1}] {NALU_t(type).name} at {pos}: {nalu[:8].tobytes()}")
-                            else:
-                                # FIXME may expect CPD to be inserted?
-                                logging.debug(f"frame[{meta['count']+1}] skipped NALU(type={type}) at {pos}: {nalu[:8].tobytes()} ending with {nalu[-1:].tobytes()}")
+                        nalus = scan_nalus(pkt, workaround=workaround, codec=codec.name)
+                        # FIXME KVS master is not ready to take AUD/SEI as part of the CPD
+                        # kept = np.isin(nalus['type'], (NALU_t.SPS, NALU_t.PPS, NALU_t.IDR, NALU_t.NIDR))
+                        kept = np.isin(nalus['type'], stream_nalus)
+                        NALUs = split_nalus(pkt, nalus[kept])
+                        if not kept.all():
+                            # FIXME may expect CPD to be inserted?
+                            for pos, _, end, type, _ in nalus[~kept].tolist():
+                                logging.debug(f"frame[{meta.count+1}] skipped NALU(type={type}) at {pos}-{end}")
                     else:
                         NALUs.append(memoryview(pkt))
                     # XXX Assme no SPS/PPS change
-                    packet = av.Packet(bytearray(b''.join(NALUs)))
-                    packet.dts = pkt.dts
-                    packet.pts = pkt.pts
-                    packet.time_base = pkt.time_base
-                    pkt = packet
+                    pkt = rewrite_packet(pkt, NALUs)
                 frame = prev
-                if session['decoding']:
+                emit = True
+                decode = False
+                if session.decoding and meta.decoder is None:
+                    decode, emit = meta.policy(prev, meta.count, meta.time, annexb)
+                    frame = None
+                    if decode and prev.is_keyframe and session.rt and meta.threads is not None and THREADS.stale(meta.threads):
+                        # Live decoders take rebalanced threads at key frames
+                        codec = renewDecoder(session)
                     try:
-                        frames = codec.decode(prev)
-                        if not frames:
+                        frames = decode and codec.decode(prev)
+                        if decode and not frames:
                             logging.warning(f"Decoded nothing, continue to read...")
-                            meta['prev'] = pkt
-                            meta['count'] += 1
+                            meta.prev = pkt
+                            meta.count += 1
                             continue
                     except Exception as e:
                         logging.error(f"Failed to decode video packet of size {prev.size}: {e}")
                         raise e
                     else:
                         # print(prev, frames)
-                        frame = frames[0]
-                        meta['width'] = frame.width
-                        meta['height'] = frame.height
-                        if format == 'BGR':
-                            frame = frame.to_rgb().to_ndarray()[:,:,::-1]
-                        elif format == 'RGB':
-                            frame = frame.to_rgb().to_ndarray()
-                if session['rt']:
+                        if decode and prev.is_keyframe and meta.snapshots is not None:
+                            meta.snapshots.update(meta.time, frames[0])
+                        if emit and meta.gate is not None:
+                            emit = meta.gate(frames[0], meta.time)
+                        if emit:
+                            frame = frames[0]
+                            if meta.mvgrid is not None:
+                                meta.motion = meta.mvgrid(frame)
+                            if format is not None:
+                                converter = meta.converter
+                                meta.width, meta.height = converter.geometry(frame.width, frame.height)
+                                frame = converter(frame, format, out=meta.sink)
+                if meta.ring is not None:
+                    meta.ring.append(meta.time, prev, prev.is_keyframe)
+                if prev.is_keyframe and meta.snapshots is not None and not decode:
+                    # Decode on request only
+                    meta.snapshots.update(meta.time, prev)
+                if session.rt:
                     '''
                     Live source from network or local camera encoder.
                     Bitstream contains no pts but frame duration.
@@ -391,7 +886,7 @@ class AVSource(object):
                         - Faster for long frame buffering
                         - Fall behind for being slower than claimed FPS: resync as now
                     '''
-                    if pkt.pts is not None and not meta['drifting']:
+                    if pkt.pts is not None and not meta.drifting:
                         # Check if drifting
                         if prev.pts is None:
                             prev.dts = prev.pts = 0
@@ -400,60 +895,129 @@ class AVSource(object):
                         # assert duration > 0, f"pkt.pts={pkt.pts}, prev.pts={prev.pts}, pkt.time_base={pkt.time_base}, pkt.duration={pkt.duration}, prev.duration={prev.duration}, duration={duration}"
                         if duration <= 0:
                             # FIXME RTSP from Dahua/QB and WiseNet/Ernie
-                            pts = prev.pts + (meta['duration'] / pkt.time_base) / 2
+                            pts = prev.pts + (meta.duration / pkt.time_base) / 2
                             duration = float((pts - prev.pts) * pkt.time_base)
                             logging.warning(f"Non-increasing pts: pkt.pts={pkt.pts}, prev.pts={prev.pts} => pts={pts}, duration={duration}")
                             pkt.pts = pts
                         
-                        timestamp = meta['time'] + duration
-                        if meta['adaptive']:
+                        timestamp = meta.time + duration
+                        if meta.adaptive:
                             # adaptive frame duration only if not KVS
                             diff = abs(timestamp - now)
-                            threshold = meta['thresholds']['drifting']
+                            threshold = meta.thresholds['drifting']
                             if diff > threshold:
-                                meta['drifting'] = True
+                                meta.drifting = True
                                 logging.warning(f"Drifting video timestamps: abs({timestamp:.3f} - {now:.3f}) = {diff:.3f} > {threshold}s")
-                    if pkt.pts is None or meta['drifting']:
+                    if pkt.pts is None or meta.drifting:
                         # Real-time against wall clock
-                        duration = now - meta['time']
-                        duration = min(1.5 / meta['fps'], duration)
-                        duration = max(0.5 / meta['fps'], duration)
-                        meta['duration'] = duration
-                        yield meta, frame
-                        meta['time'] += duration
+                        duration = now - meta.time
+                        duration = min(1.5 / meta.fps, duration)
+                        duration = max(0.5 / meta.fps, duration)
+                        meta.duration = duration
+                        if emit:
+                            yield meta, frame
+                        meta.time += duration
                     else:
-                        meta['duration'] = duration
-                        yield meta, frame
-                        meta['time'] = timestamp
+                        meta.duration = duration
+                        if emit:
+                            yield meta, frame
+                        meta.time = timestamp
                 else:
-                    # TODO: no sleep for being handled by renderer playback
-                    # Simulating RT
-                    meta['duration'] = 1.0 / meta['fps']
-                    slack = (meta['time'] + meta['duration']) - now
-                    if slack > 0:
-                        logging.debug(f"Sleeping for {slack:.3f}s to simulate RT source")
-                        time.sleep(slack)
-                    yield meta, frame
-                    meta['time'] += meta['duration']
-                meta['keyframe'] = keyframe
+                    if meta.end is not None and meta.time >= meta.end:
+                        logging.info(f"Reached the end at {meta.time - session.get('origin', session.start):.3f}s")
+                        return None
+                    # Simulating RT at the replay speed or no sleep at max
+                    meta.duration = 1.0 / meta.fps
+                    if emit:
+                        speed = meta.replay
+                        if speed:
+                            wall, start = meta.anchor
+                            slack = wall + (meta.time + meta.duration - start) / speed - now
+                            if slack > 0:
+                                logging.debug(f"Sleeping for {slack:.3f}s to simulate RT source at {speed}x")
+                                time.sleep(slack)
+                        yield meta, frame
+                    meta.time += meta.duration
+                meta.keyframe = keyframe
             if pkt.size == 0:
                 logging.warning(f"EOF/EOS on empty packet")
                 return None
             else:
-                meta['prev'] = pkt
-                meta['count'] += 1
+                meta.prev = pkt
+                meta.count += 1
+
+    def read_parallel(self, session, format='BGR'):
+        '''Decode packets of intra-only video from read_video() by the session parallel decoder in order.
+
+        Packets to emit are read ahead up to the number of decoders on a shadow copy of the session video state
+        so that the consumer only sees the state snapshot of the frame it has just read.
+        '''
+        meta = session['video']
+        decoder = meta['decoder']
+        policy = meta['policy']
+        gate = meta['gate']
+        shadow = session.copy()
+        shadow['video'] = state = meta.copy()
+        state.pop('framer', None)
+
+        def emit():
+            frame, converted, snapshot = decoder.next()
+            if frame is None:
+                logging.warning(f"Decoded nothing from frame[{snapshot['count']}]")
+                return None
+            if gate is not None and not gate(frame, snapshot['time']):
+                return None
+            meta.update(snapshot)
+            if format is not None:
+                meta['width'], meta['height'] = decoder.converter.geometry(frame.width, frame.height)
+            return converted
+
+        framer = self.read_video(shadow, format)
+        try:
+            for state, pkt in framer:
+                _, emitting = policy(pkt, state['count'], state['time'])
+                if not emitting:
+                    continue
+                decoder.submit(pkt, format, dict(state))
+                if decoder.full:
+                    frame = emit()
+                    if frame is not None:
+                        yield meta, frame
+            while len(decoder) > 0:
+                frame = emit()
+                if frame is not None:
+                    yield meta, frame
+        finally:
+            framer.close()
+            decoder.reset()
 
     def read(self, session, media='video', format='BGR'):
+        '''Read the next frame of the media.
+
+        Args:
+            format(str): BGR | RGB | GRAY or None to keep decoded video frames unconverted
+        Returns:
+            (media, meta, frame) or None on EOS
+        '''
         if session is None or media not in session:
             logging.error(f"{media} not in session to read")
             return None
         try:
             if media == 'video':
                 meta = session[media]
-                stream = meta['stream']
-                codec = meta['codec']
-                meta['framer'] = framer = meta.get('framer', self.read_video(session, format))
+                framer = meta.get('framer', None)
+                if framer is None:
+                    reader = meta.get('decoder', None) is None and self.read_video or self.read_parallel
+                    if meta.get('prefetch', 0) > 0:
+                        framer = Prefetcher(session, media, lambda shadow: reader(shadow, format), meta['prefetch'])
+                    else:
+                        framer = reader(session, format)
+                    meta['framer'] = framer
                 meta, frame = next(framer)
+                stats = meta.get('stats', None)
+                if stats is not None and stats.get('ttff', 0) is None:
+                    stats['ttff'] = time.time() - session['opened']
+                    logging.info(f"Time to first frame: {stats['ttff']:.3f}s")
             elif media == 'audio':
                 meta = session[media]
                 stream = meta['stream']
@@ -468,6 +1032,126 @@ class AVSource(object):
         else:
             return media, meta, frame
     
+    async def arun(self, func, *args, executor=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor or self.executor, partial(func, *args, **kwargs))
+
+    async def aopen(self, *args, executor=None, **kwargs):
+        '''Open streaming sessions without blocking the event loop.
+        '''
+        return await self.arun(self.open, *args, executor=executor, **kwargs)
+
+    async def aclose(self, session, executor=None):
+        return await self.arun(self.close, session, executor=executor)
+
+    async def aread(self, session, media='video', format='BGR', executor=None):
+        '''Read the next frame as read() without blocking the event loop.
+        Network waits and decoding take place in the executor.
+        '''
+        return await self.arun(self.read, session, media=media, format=format, executor=executor)
+
+    async def aiter(self, session, media='video', format='BGR', executor=None):
+        '''Iterate (media, meta, frame) through `async for` until EOS.
+        '''
+        while True:
+            res = await self.aread(session, media=media, format=format, executor=executor)
+            if res is None:
+                break
+            yield res
+
+    def read_batch(self, session, n, out=None, format='BGR'):
+        '''Read up to n decoded video frames into slices of a contiguous batch array.
+
+        Frames are converted straight into the batch unless prefetched.
+
+        Args:
+            session(dict): decoding session from open()
+            n(int): max number of frames to read
+            out(np.ndarray): (N, H, W, C) or (N, H, W) for GRAY with N >= n, pooled if not given
+            format(str): BGR | RGB | GRAY
+        Returns:
+            frames(np.ndarray): out[:k] of k frames read or None on EOS
+            meta(dict): arrays of time, duration, keyframe and count per frame
+        '''
+        if not session['decoding']:
+            raise ValueError(f"Batch reads require a decoding session")
+        meta = session['video']
+        if out is None:
+            shape = (n, meta['height'], meta['width']) + (() if format == 'GRAY' else (3,))
+            pool = meta.get('batches', None)
+            if pool is None:
+                pool = meta['batches'] = FramePool(2)
+            out = pool.next(shape)
+        batch = dict(
+            time=np.zeros(n, dtype=np.float64),
+            duration=np.zeros(n, dtype=np.float64),
+            keyframe=np.zeros(n, dtype=bool),
+            count=np.zeros(n, dtype=np.int64),
+        )
+        prefetched = meta.get('prefetch', 0) > 0
+        k = 0
+        while k < n:
+            slot = out[k]
+            if not prefetched:
+                meta['sink'] = slot
+            try:
+                res = self.read(session, media='video', format=format)
+            finally:
+                meta['sink'] = None
+            if res is None:
+                break
+            _, media, frame = res
+            if frame is not slot:
+                np.copyto(slot, frame)
+            batch['time'][k] = media['time']
+            batch['duration'][k] = media['duration'] or 0
+            batch['keyframe'][k] = media['keyframe']
+            batch['count'][k] = media['count']
+            k += 1
+        if k == 0:
+            return None
+        return out[:k], {key: value[:k] for key, value in batch.items()}
+
+    def export_clip(self, session, t0, t1, path, format=None):
+        '''Remux buffered packets from the key frame at or before t0 through t1 without decoding.
+
+        Args:
+            session(dict): session opened with the ring option
+            t0(float): clip start in frame time
+            t1(float): clip end in frame time
+            path(str): output MP4/MKV path
+            format(str): container format or by the path extension
+        Returns:
+            secs of the clip exported
+        '''
+        meta = session['video']
+        ring = meta.get('ring', None)
+        if ring is None:
+            raise ValueError(f"No packet ring in the session to export a clip")
+        packets = ring.clip(t0, t1)
+        streams = session.get('streams', None)
+        template = streams is not None and streams.streams.video[0] or None
+        if meta.get('avcc', None) is not None:
+            # Packets converted to Annex B with the CPD on key frames unlike the avcC/hvcC of the source stream
+            template = None
+        return export_clip(packets, path, template=template, codec=meta['codec'].name, width=meta['width'], height=meta['height'], format=format)
+
+    def snapshot(self, session, format='jpeg', size=None, t=None):
+        '''Latest key frame from memory with the encoded image cached until the next key frame.
+
+        Args:
+            session(dict): session opened with the snapshots option
+            format(str): jpeg | png | BGR | RGB | GRAY
+            size(Tuple[int, int]): optional (H, W) to scale to
+            t(float): frame time to take the key frame at or before
+        Returns:
+            (time, image) of bytes or np.ndarray or None if no key frame yet
+        '''
+        snapshots = session['video'].get('snapshots', None)
+        if snapshots is None:
+            raise ValueError(f"No snapshot cache in the session")
+        return snapshots.snapshot(format, size, t)
+
     def get(self, session, key, media='video'):
         if media == 'video' and media in session:
             video = session[media]
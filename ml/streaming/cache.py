@@ -0,0 +1,105 @@
+# Copyright (c) 2017-present, NEC Laboratories America, Inc. ("NECLA").
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory
+
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+from threading import Lock
+from urllib.parse import urlparse
+
+from ml import logging
+
+CACHE_HOME = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'ml-ws'
+
+# Default ports by URL scheme
+PORTS = dict(
+    rtsp=554,
+    rtsps=322,
+    http=80,
+    https=443,
+)
+
+def host_key(url):
+    '''Cache key of the host and port from an URL without user credentials.
+    '''
+    url = urlparse(str(url))
+    return f"{url.scheme}://{url.hostname}:{url.port or PORTS.get(url.scheme, 0)}"
+
+def url_key(url):
+    '''Cache key of a full URL hashed not to persist credentials in the URL.
+    '''
+    return hashlib.sha1(str(url).encode()).hexdigest()
+
+def stream_key(url):
+    '''Cache key of a stream URL to reopen or None if not expected to repeat.
+
+    RTSP URLs are kept in full as the query may select the channel.
+    HTTP(S) URLs with a query such as KVS HLS session tokens or presigned S3 URLs are not cached.
+    '''
+    url = str(url)
+    if url.startswith('rtsp') or url.startswith('http') and not urlparse(url).query:
+        return url_key(url)
+    return None
+
+class Cache(object):
+    '''Small persistent JSON key-value cache with entries expiring after TTL.
+
+    The cache is shared by processes on the host.
+    Writes are atomic by replacement and failures to persist are only logged.
+    '''
+
+    def __init__(self, name, ttl=24 * 60 * 60, root=None):
+        '''
+        Args:
+            name(str): cache file name without the extension
+            ttl(float): secs for entries to expire
+            root(str | Path): cache directory or CACHE_HOME by default
+        '''
+        self.path = Path(root or CACHE_HOME) / f"{name}.json"
+        self.ttl = ttl
+        self.lock = Lock()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def dump(self, entries):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.warning(f"Failed to save cache {self.path}: {e}")
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.load().get(key, None)
+        if entry is None or time.time() - entry['time'] > self.ttl:
+            return default
+        return entry['value']
+
+    def set(self, key, value):
+        now = time.time()
+        with self.lock:
+            entries = {k: entry for k, entry in self.load().items() if now - entry['time'] <= self.ttl}
+            entries[key] = dict(time=now, value=value)
+            self.dump(entries)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entries = self.load()
+            entry = entries.pop(key, None)
+            if entry is not None:
+                self.dump(entries)
+        return default if entry is None else entry['value']
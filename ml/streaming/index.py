@@ -0,0 +1,145 @@
+# Copyright (c) 2017-present, NEC Laboratories America, Inc. ("NECLA").
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory
+
+import os
+import json
+from pathlib import Path
+from fractions import Fraction
+
+import numpy as np
+
+from ml import av, logging
+from .cache import CACHE_HOME, url_key
+
+VERSION = 1
+
+def index_path(path):
+    '''Sidecar keyframe index path next to the video file.
+    '''
+    path = Path(path)
+    return path.with_name(f"{path.name}.kfi.json")
+
+class KeyframeIndex(object):
+    '''Keyframe index of a local video file with one entry per GOP.
+
+    Entries:
+        pos: byte offset of the key frame packet
+        pts: key frame pts in the stream time base or None if unavailable
+        time: secs from the first frame
+        count: number of packets before the key frame in demux order
+    '''
+
+    def __init__(self, time_base, fps, frames, pos, pts, time, count, size=None, mtime=None):
+        self.time_base = Fraction(time_base) if time_base else None
+        self.fps = fps
+        self.frames = frames
+        self.pos = list(pos)
+        self.pts = list(pts)
+        self.time = np.asarray(time, dtype=np.float64)
+        self.count = np.asarray(count, dtype=np.int64)
+        self.size = size
+        self.mtime = mtime
+
+    def __len__(self):
+        return len(self.time)
+
+    def locate(self, t, fps=None):
+        '''Entry of the nearest key frame at or before t secs from the first frame.
+
+        Args:
+            t(float): secs from the first frame
+            fps(float): nominal FPS to time key frames by packet count as sessions do or by time if None
+        '''
+        time = self.time if fps is None else self.count / fps
+        return max(0, int(np.searchsorted(time, t, side='right')) - 1)
+
+    def gops(self):
+        '''GOPs as (start, end) packet counts in demux order.
+        '''
+        ends = list(self.count[1:]) + [self.frames]
+        return list(zip(self.count.tolist(), map(int, ends)))
+
+    def to_dict(self):
+        return dict(
+            version=VERSION,
+            size=self.size,
+            mtime=self.mtime,
+            time_base=self.time_base and str(self.time_base) or None,
+            fps=self.fps,
+            frames=self.frames,
+            keyframes=dict(
+                pos=self.pos,
+                pts=self.pts,
+                time=self.time.tolist(),
+                count=self.count.tolist(),
+            ),
+        )
+
+    @classmethod
+    def from_dict(cls, entries):
+        return cls(entries['time_base'], entries['fps'], entries['frames'], size=entries['size'], mtime=entries['mtime'], **entries['keyframes'])
+
+def build_index(path):
+    '''Build the keyframe index of a local video file by a single demux pass without decoding.
+    '''
+    stat = os.stat(path)
+    with av.open(str(path)) as source:
+        video0 = source.streams.video[0]
+        time_base = video0.time_base
+        rate = video0.average_rate or video0.guessed_rate
+        fps = rate and float(rate) or 30.0
+        pos, pts, time, count = [], [], [], []
+        start = None
+        frames = 0
+        for pkt in source.demux(video0):
+            if pkt.size == 0:
+                continue
+            if pkt.is_keyframe:
+                if pkt.pts is None or time_base is None:
+                    t = frames / fps
+                else:
+                    start = pkt.pts if start is None else start
+                    t = float((pkt.pts - start) * time_base)
+                pos.append(pkt.pos)
+                pts.append(pkt.pts)
+                time.append(t)
+                count.append(frames)
+            frames += 1
+    logging.info(f"Indexed {len(count)} key frames out of {frames} packets in {path}")
+    return KeyframeIndex(time_base, fps, frames, pos, pts, time, count, size=stat.st_size, mtime=stat.st_mtime_ns)
+
+def load_index(path, build=True):
+    '''Load the sidecar keyframe index of a local video file or build one if missing or stale.
+
+    The index is saved next to the file or in the cache directory if not writable.
+    '''
+    stat = os.stat(path)
+    fallback = CACHE_HOME / 'index' / f"{url_key(Path(path).resolve())}.kfi.json"
+    for sidecar in (index_path(path), fallback):
+        try:
+            with open(sidecar) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if entries.get('version') == VERSION and (entries['size'], entries['mtime']) == (stat.st_size, stat.st_mtime_ns):
+            return KeyframeIndex.from_dict(entries)
+        logging.info(f"Stale keyframe index {sidecar}")
+
+    if not build:
+        return None
+    index = build_index(path)
+    for sidecar in (index_path(path), fallback):
+        try:
+            sidecar.parent.mkdir(parents=True, exist_ok=True)
+            with open(sidecar, 'w') as f:
+                json.dump(index.to_dict(), f)
+        except OSError as e:
+            logging.warning(f"Failed to save keyframe index {sidecar}: {e}")
+        else:
+            logging.info(f"Saved keyframe index {sidecar}")
+            break
+    return index
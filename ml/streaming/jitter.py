@@ -0,0 +1,181 @@
+# Copyright (c) 2017-present, NEC Laboratories America, Inc. ("NECLA").
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory
+
+import time
+from collections import deque
+from threading import Condition
+
+from ml import logging
+from ..ws.executor import Executor
+
+EOS = object()
+
+class JitterBuffer(Executor):
+    '''Read-ahead buffer of demuxed packets from a network source filled by a worker thread.
+
+    Packets are released after prefilling `seconds` and paced by their pts from then on
+    so that bursts after network hiccups are absorbed before the timestamp logic.
+    An underrun happens if a packet is not buffered by its playout time.
+    The playout is then shifted by the stall instead of bursting to catch up.
+    The playout is re-anchored on a discontinuity where the packet time jumps
+    backward or ahead of the previous one by more than `seconds`.
+    The worker is blocked once `size` bytes are buffered.
+    '''
+
+    def __init__(self, stream, seconds=0.5, size=8 * 2**20, fps=None, name=None):
+        '''
+        Args:
+            stream(Iterator[av.Packet]): demuxer of the network source
+            seconds(float): secs of packets to prefill and delay the playout by
+            size(int): max bytes of packets to buffer
+            fps(float): nominal FPS to pace packets without pts
+        '''
+        super(JitterBuffer, self).__init__(name or 'JitterBuffer')
+        self.stream = stream
+        self.seconds = seconds
+        self.size = size
+        self.period = fps and 1.0 / fps or 0
+        self.packets = deque()      # (arrival, secs, packet)
+        self.cond = Condition()
+        self.bytes = 0
+        self.anchor = None          # (wall clock, packet secs) to pace the playout from
+        self.last = None            # secs of the last packet released
+        self.origin = None          # first dts/pts
+        self.count = 0
+        self.stats = dict(
+            fill=0,                 # secs buffered on last read
+            bytes=0,                # bytes buffered on last read
+            max_bytes=0,
+            packets=0,
+            underruns=0,
+            discontinuities=0,
+            stalled=0,              # secs the consumer waited on underruns
+            blocked=0,              # secs the worker is blocked by a full buffer
+        )
+        self.start()
+
+    def secs(self, pkt):
+        '''Packet time in secs from the first packet by dts/pts in demux order or by count.
+        '''
+        ts = pkt.pts if pkt.dts is None else pkt.dts
+        if ts is None or pkt.time_base is None:
+            return self.count * self.period
+        if self.origin is None:
+            self.origin = ts
+        return float((ts - self.origin) * pkt.time_base)
+
+    def fill(self):
+        '''Secs of packets buffered.
+        '''
+        packets = self.packets
+        if not packets or packets[-1][1] is EOS:
+            return len(packets) > 1 and packets[-2][1] - packets[0][1] or 0
+        return packets[-1][1] - packets[0][1]
+
+    def put(self, item, size=0):
+        cond = self.cond
+        with cond:
+            start = time.time()
+            while self.bytes + size > self.size and self.packets and not self.stop_event.is_set():
+                cond.wait(0.1)
+            self.stats['blocked'] += time.time() - start
+            if self.stop_event.is_set():
+                return False
+            self.packets.append(item)
+            self.bytes += size
+            self.stats['max_bytes'] = max(self.stats['max_bytes'], self.bytes)
+            cond.notify_all()
+        return True
+
+    def run(self):
+        try:
+            for pkt in self.stream:
+                if not self.put((time.time(), self.secs(pkt), pkt), pkt.size):
+                    break
+                self.count += 1
+            else:
+                self.put((time.time(), EOS, None))
+        except Exception as e:
+            logging.error(f"{self.name} failed to demux: {e}")
+            self.put((time.time(), EOS, e))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        cond = self.cond
+        stats = self.stats
+        packets = self.packets
+        waited = None
+        stop = self.stop_event
+        with cond:
+            if self.anchor is None:
+                # Prefill
+                while not (packets and packets[-1][1] is EOS) and (self.fill() < self.seconds and self.bytes < self.size) and not stop.is_set():
+                    cond.wait(0.1)
+            elif not packets:
+                waited = time.time()
+                while not packets and not stop.is_set():
+                    cond.wait(0.1)
+            if stop.is_set():
+                raise StopIteration
+
+            _, secs, pkt = packets[0]
+            if secs is EOS:
+                if isinstance(pkt, Exception):
+                    raise pkt
+                raise StopIteration
+            if self.anchor is None:
+                self.anchor = (time.time(), secs)
+
+        now = time.time()
+        if self.last is not None and not 0 <= secs - self.last <= self.seconds:
+            # Discontinuity to play out from now
+            stats['discontinuities'] += 1
+            logging.warning(f"{self.name} re-anchored on a discontinuity of {secs - self.last:.3f}s")
+            self.anchor = (now, secs)
+            waited = None
+        wall, start = self.anchor
+        slack = wall + (secs - start) - now
+        if slack > 0:
+            time.sleep(min(slack, self.seconds))
+        elif waited is not None:
+            # Underrun to shift the playout by the stall
+            stats['underruns'] += 1
+            stats['stalled'] += now - waited
+            self.anchor = (wall - slack, start)
+            logging.debug(f"{self.name} underrun late by {-slack:.3f}s")
+
+        self.last = secs
+        with cond:
+            packets.popleft()
+            self.bytes -= pkt.size
+            stats['packets'] += 1
+            stats['fill'] = self.fill()
+            stats['bytes'] = self.bytes
+            cond.notify_all()
+        return pkt
+
+    def close(self, timeout=10):
+        if not self.running:
+            return
+        self.running = False
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+        self._runner.join(timeout=timeout)
+        if self._runner.is_alive():
+            logging.warning(f"{self.name} not stopped in {timeout}s")
+        self._runner = None
+
+    @classmethod
+    def create(cls, stream, jitter, fps=None):
+        '''Buffer from a session option of None, True for defaults or a dict of seconds and size.
+        '''
+        if not jitter:
+            return None
+        return cls(stream, fps=fps) if jitter is True else cls(stream, fps=fps, **jitter)
@@ -0,0 +1,180 @@
+# Copyright (c) 2017-present, NEC Laboratories America, Inc. ("NECLA").
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory
+
+import os
+from itertools import count
+from queue import Queue, Empty
+from threading import Thread, Event, Condition
+
+from ml import logging
+
+class MultiSourceReader(object):
+    '''Fan in frames from many streaming sessions with a small pool of worker threads.
+
+    Sessions are served round robin: a session is queued for its next read only
+    after its previous read completes and while fewer than `maxsize` of its frames
+    are pending for the consumer. A slow consumer therefore stalls no worker on
+    a single session and each session gets a fair share of the workers.
+
+    Usage:
+        reader = MultiSourceReader(workers=8)
+        src = AVSource.create(url)
+        reader.add(src, src.open(decoding=True))
+        for sid, media, meta, frame in reader:
+            if media is None:
+                # session ended on EOS or error in frame if any
+                ...
+    '''
+
+    def __init__(self, workers=None, maxsize=2):
+        '''
+        Args:
+            workers(int): number of reader threads, default to the number of CPUs
+            maxsize(int): max frames pending per session before pausing reading it
+        '''
+        self.maxsize = maxsize
+        self.sessions = {}
+        self.ready = Queue()
+        self.frames = Queue()
+        self.lock = Condition()
+        self.ids = count()
+        self.stop_event = Event()
+        self.threads = [Thread(name=f"MultiSourceReader[{i}]", target=self.run, daemon=True) for i in range(workers or os.cpu_count())]
+        for thread in self.threads:
+            thread.start()
+
+    def add(self, source, session, media='video', format='BGR', sid=None):
+        '''Add a session opened from the source to read.
+
+        Args:
+            source(AVSource): source the session is opened from, e.g. AVSource, KVSource or NUUOSource
+            session(dict): session from source.open()
+            media(str): media to read
+            format(str): frame format to read
+            sid(Hashable): session id or a generated integer
+        Returns:
+            sid: the session id yielded with frames
+        '''
+        sid = next(self.ids) if sid is None else sid
+        with self.lock:
+            if sid in self.sessions:
+                raise ValueError(f"Session {sid} already added")
+            self.sessions[sid] = dict(
+                source=source,
+                session=session,
+                media=media,
+                format=format,
+                pending=0,
+                paused=False,
+                busy=False,
+                frames=0,
+                pauses=0,
+            )
+        self.ready.put(sid)
+        return sid
+
+    def remove(self, sid):
+        '''Stop reading a session and wait for any read in progress.
+        The caller is responsible for closing the session afterwards.
+        '''
+        with self.lock:
+            entry = self.sessions.pop(sid, None)
+            while entry is not None and entry['busy']:
+                self.lock.wait()
+            return entry is not None
+
+    def stats(self):
+        with self.lock:
+            return {sid: dict(pending=entry['pending'], frames=entry['frames'], pauses=entry['pauses'])
+                    for sid, entry in self.sessions.items()}
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                sid = self.ready.get(timeout=0.1)
+            except Empty:
+                continue
+            with self.lock:
+                entry = self.sessions.get(sid, None)
+                if entry is None:
+                    continue
+                entry['busy'] = True
+            try:
+                res = entry['source'].read(entry['session'], media=entry['media'], format=entry['format'])
+            except Exception as e:
+                res = e
+            finally:
+                with self.lock:
+                    entry['busy'] = False
+                    self.lock.notify_all()
+
+            if isinstance(res, Exception) or res is None:
+                if res is None:
+                    logging.info(f"Session {sid} reached EOS")
+                else:
+                    logging.error(f"Session {sid} failed to read: {res}")
+                with self.lock:
+                    # Queue the end along with the removal for __next__ not to stop in between
+                    self.sessions.pop(sid, None)
+                    self.frames.put((sid, None, None, res))
+                continue
+
+            m, meta, frame = res
+            with self.lock:
+                if self.sessions.get(sid, None) is not entry:
+                    # removed while reading
+                    continue
+                entry['pending'] += 1
+                entry['frames'] += 1
+                paused = entry['paused'] = entry['pending'] >= self.maxsize
+                entry['pauses'] += paused
+            # XXX meta is updated in place by the next read
+            self.frames.put((sid, m, dict(meta), frame))
+            if not paused:
+                self.ready.put(sid)
+
+    def read(self, timeout=None):
+        '''Read the next ready frame from any session.
+
+        Returns:
+            (sid, media, meta, frame) or None on timeout.
+            media is None if the session is removed on EOS or on error given as frame.
+        '''
+        try:
+            sid, m, meta, frame = self.frames.get(timeout=timeout)
+        except Empty:
+            return None
+        if m is not None:
+            resume = False
+            with self.lock:
+                entry = self.sessions.get(sid, None)
+                if entry is not None:
+                    entry['pending'] -= 1
+                    if entry['paused'] and entry['pending'] < self.maxsize:
+                        entry['paused'] = False
+                        resume = True
+            if resume:
+                self.ready.put(sid)
+        return sid, m, meta, frame
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            res = self.read(timeout=0.1)
+            if res is not None:
+                return res
+            with self.lock:
+                if not self.sessions and self.frames.empty():
+                    raise StopIteration
+
+    def close(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads.clear()
@@ -0,0 +1,279 @@
+# Copyright (c) 2017-present, NEC Laboratories America, Inc. ("NECLA").
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory
+
+from enum import IntEnum
+from itertools import chain
+
+import numpy as np
+
+from ml import av, logging
+from ml.av import NALU_t
+
+START_CODE = b'\x00\x00\x00\x01'
+
+# FFMPEG codec names of H.265
+HEVC = ('hevc', 'h265')
+
+class HEVC_NALU_t(IntEnum):
+    '''H.265 NALU types in the 6-bit field of the 2-byte NALU header.
+    '''
+    TRAIL_N = 0
+    TRAIL_R = 1
+    TSA_N = 2
+    TSA_R = 3
+    STSA_N = 4
+    STSA_R = 5
+    RADL_N = 6
+    RADL_R = 7
+    RASL_N = 8
+    RASL_R = 9
+    RSV_VCL_N10 = 10
+    RSV_VCL_R11 = 11
+    RSV_VCL_N12 = 12
+    RSV_VCL_R13 = 13
+    RSV_VCL_N14 = 14
+    RSV_VCL_R15 = 15
+    BLA_W_LP = 16
+    BLA_W_RADL = 17
+    BLA_N_LP = 18
+    IDR_W_RADL = 19
+    IDR_N_LP = 20
+    CRA = 21
+    RSV_IRAP_VCL22 = 22
+    RSV_IRAP_VCL23 = 23
+    RSV_VCL24 = 24
+    RSV_VCL25 = 25
+    RSV_VCL26 = 26
+    RSV_VCL27 = 27
+    RSV_VCL28 = 28
+    RSV_VCL29 = 29
+    RSV_VCL30 = 30
+    RSV_VCL31 = 31
+    VPS = 32
+    SPS = 33
+    PPS = 34
+    AUD = 35
+    EOS = 36
+    EOB = 37
+    FD = 38
+    PREFIX_SEI = 39
+    SUFFIX_SEI = 40
+
+# H.265 VCL NALU types
+HEVC_VCL_NALUS = tuple(range(HEVC_NALU_t.VPS))
+
+# Parameter sets of the CPD in order by codec
+PARAMETER_SETS = dict(
+    h264=(NALU_t.SPS, NALU_t.PPS),
+    hevc=(HEVC_NALU_t.VPS, HEVC_NALU_t.SPS, HEVC_NALU_t.PPS),
+)
+
+def nalu_types(codec='h264'):
+    '''NALU type enum of H.264 or H.265 by the FFMPEG codec name.
+    '''
+    return HEVC_NALU_t if codec in HEVC else NALU_t
+
+# NALU boundaries: start including the START CODE, header offset and end exclusive
+NALU_DTYPE = np.dtype([
+    ('pos', np.int64),
+    ('hdr', np.int64),
+    ('end', np.int64),
+    ('type', np.uint8),
+    ('idc', np.uint8),
+])
+
+def scan_nalus(buf, workaround=False, codec='h264'):
+    '''Locate all H.264/H.265 NALUs in an Annex B buffer in one vectorized pass.
+
+    Equivalent to iterating over `NALUParser(buf, workaround)` but without per byte Python iteration.
+    For H.265, idc is 0 for sub-layer non-reference pictures or 1 otherwise.
+
+    Args:
+        buf: bytes-like object such as av.Packet, memoryview, bytes or bytearray
+        workaround: trim NALU trailing zero bytes that confuse KVS
+            https://github.com/awslabs/amazon-kinesis-video-streams-producer-sdk-cpp/issues/491
+        codec(str): h264 | hevc
+    Returns:
+        nalus(np.ndarray): records of NALU_DTYPE in bitstream order
+    '''
+    data = np.frombuffer(buf, dtype=np.uint8)
+    size = data.size
+    if size < 4:
+        return np.empty(0, dtype=NALU_DTYPE)
+
+    # 00 00 01 followed by at least one header byte
+    ones = np.flatnonzero(data[2:-1] == 1) + 2
+    ones = ones[(data[ones - 1] == 0) & (data[ones - 2] == 0)]
+    nalus = np.empty(ones.size, dtype=NALU_DTYPE)
+    if ones.size == 0:
+        return nalus
+
+    # 4-byte START CODE if preceded by another zero byte
+    pos = ones - 2
+    pos -= (pos > 0) & (data[np.maximum(pos - 1, 0)] == 0)
+    hdr = ones + 1
+    end = np.empty_like(pos)
+    end[:-1] = pos[1:]
+    end[-1] = size
+    if workaround:
+        # XXX NALUs ending with zero bytes e.g. NUUO PPS followed by three consecutive zero bytes
+        trailing = (end > hdr + 1) & (data[end - 1] == 0)
+        while trailing.any():
+            end -= trailing
+            trailing = (end > hdr + 1) & (data[end - 1] == 0)
+
+    header = data[hdr]
+    nalus['pos'] = pos
+    nalus['hdr'] = hdr
+    nalus['end'] = end
+    if codec in HEVC:
+        types = (header >> 1) & 0x3F
+        nalus['type'] = types
+        # Even VCL types up to RSV_VCL_N14 are sub-layer non-reference
+        nalus['idc'] = ~((types <= HEVC_NALU_t.RSV_VCL_N14) & (types % 2 == 0))
+    else:
+        nalus['type'] = header & 0x1F
+        nalus['idc'] = (header >> 5) & 0x03
+    return nalus
+
+def is_reference(buf, codec='h264'):
+    '''Whether an Annex B access unit may be referenced by others by its VCL NALUs.
+    '''
+    nalus = scan_nalus(buf, codec=codec)
+    if codec in HEVC:
+        vcl = nalus[nalus['type'] < HEVC_NALU_t.VPS]
+    else:
+        vcl = nalus[(nalus['type'] == NALU_t.NIDR) | (nalus['type'] == NALU_t.IDR)]
+    return vcl.size == 0 or bool((vcl['idc'] > 0).any())
+
+def split_nalus(buf, nalus):
+    '''Slice NALUs located by scan_nalus() out of the buffer without copying.
+    '''
+    view = memoryview(buf)
+    return [view[pos:end] for pos, end in zip(nalus['pos'].tolist(), nalus['end'].tolist())]
+
+def gather_packet(pkt, chunks):
+    '''Gather chunks straight into the memory of a new packet with the same dts/pts/time_base/keyframe.
+    '''
+    packet = av.Packet(sum(map(len, chunks)))
+    view = memoryview(packet)
+    offset = 0
+    for chunk in chunks:
+        end = offset + len(chunk)
+        view[offset:end] = chunk
+        offset = end
+    view.release()
+    packet.dts = pkt.dts
+    packet.pts = pkt.pts
+    packet.time_base = pkt.time_base
+    packet.is_keyframe = pkt.is_keyframe
+    return packet
+
+def rewrite_packet(pkt, NALUs, CPD=()):
+    '''Rebuild a packet from the NALUs kept and the CPD to prepend.
+
+    The original packet is passed through untouched if nothing is dropped or prepended.
+    Otherwise, the NALUs are gathered straight into the memory of a new packet with one copy.
+
+    Args:
+        pkt(av.Packet): original packet the NALUs are sliced from
+        NALUs(List[memoryview]): NALUs to keep in order
+        CPD(List[bytes]): out of band SPS/PPS to prepend if any
+    Returns:
+        packet(av.Packet): pkt or a new packet with the same dts/pts/time_base/keyframe
+    '''
+    if not CPD and sum(map(len, NALUs)) == pkt.size:
+        return pkt
+    return gather_packet(pkt, list(chain(CPD, NALUs)))
+
+def is_avcc(extradata):
+    '''Whether the codec extradata is an AVC/HEVCDecoderConfigurationRecord rather than Annex B.
+    '''
+    return bool(extradata) and len(extradata) >= 7 and extradata[0] == 1
+
+def parse_avcc(extradata):
+    '''Parse the AVCDecoderConfigurationRecord of MP4/MKV/DASH avcC extradata.
+
+    Returns:
+        (length_size, CPD): size of NALU length prefixes and SPS/PPS NALUs with START CODE
+    '''
+    if not is_avcc(extradata):
+        raise ValueError(f"Invalid avcC extradata: {bytes(extradata[:8])}")
+    data = memoryview(extradata)
+    length_size = (data[4] & 0x03) + 1
+    CPD = []
+    offset = 5
+    # Number of SPS in 5 bits followed by the number of PPS in 8 bits
+    for mask in (0x1F, 0xFF):
+        count = data[offset] & mask
+        offset += 1
+        for _ in range(count):
+            size = int.from_bytes(data[offset:offset + 2], 'big')
+            offset += 2
+            CPD.append(START_CODE + bytes(data[offset:offset + size]))
+            offset += size
+    return length_size, CPD
+
+def parse_hvcc(extradata):
+    '''Parse the HEVCDecoderConfigurationRecord of MP4/MKV hvcC extradata.
+
+    Returns:
+        (length_size, CPD): size of NALU length prefixes and VPS/SPS/PPS/SEI NALUs with START CODE
+    '''
+    if not is_avcc(extradata) or len(extradata) < 23:
+        raise ValueError(f"Invalid hvcC extradata: {bytes(extradata[:8])}")
+    data = memoryview(extradata)
+    length_size = (data[21] & 0x03) + 1
+    CPD = []
+    offset = 23
+    # Arrays of NALUs by type
+    for _ in range(data[22]):
+        count = int.from_bytes(data[offset + 1:offset + 3], 'big')
+        offset += 3
+        for _ in range(count):
+            size = int.from_bytes(data[offset:offset + 2], 'big')
+            offset += 2
+            CPD.append(START_CODE + bytes(data[offset:offset + size]))
+            offset += size
+    return length_size, CPD
+
+def avcc_to_annexb(pkt, length_size=4, CPD=(), codec='h264'):
+    '''Convert a length prefixed AVCC/HVCC packet to Annex B in one copy.
+
+    Equivalent to the FFMPEG h264_mp4toannexb/hevc_mp4toannexb bitstream filters without a subprocess.
+
+    Args:
+        pkt(av.Packet): AVCC/HVCC packet from MP4/MKV/DASH
+        length_size(int): size of NALU length prefixes from parse_avcc() or parse_hvcc()
+        CPD(List[bytes]): parameter sets to prepend to key frames unless in band
+        codec(str): h264 | hevc
+    Returns:
+        packet(av.Packet): new packet with the same dts/pts/time_base/keyframe
+    '''
+    hevc = codec in HEVC
+    view = memoryview(pkt)
+    size = len(view)
+    chunks = []
+    inband = False
+    offset = 0
+    while offset + length_size <= size:
+        length = int.from_bytes(view[offset:offset + length_size], 'big')
+        offset += length_size
+        if offset + length > size:
+            logging.warning(f"Truncated AVCC NALU of {length} bytes at {offset - length_size} in a packet of {size} bytes")
+            break
+        if length > 0:
+            if hevc:
+                inband = inband or (view[offset] >> 1) & 0x3F == HEVC_NALU_t.SPS
+            else:
+                inband = inband or (view[offset] & 0x1F) == NALU_t.SPS
+            chunks.append(START_CODE)
+            chunks.append(view[offset:offset + length])
+        offset += length
+    if pkt.is_keyframe and not inband:
+        chunks[:0] = CPD
+    return gather_packet(pkt, chunks)
@@ -3,12 +3,20 @@ from time import time, sleep
 from xml.etree import ElementTree as ET
 
 import requests, base64
+import numpy as np
 
 from ml import av, logging
-from ml.av import h264
 from ml.av import NALU_t
 from ml.time import fromFileTime
 from .avsource import AVSource
+from .nalu import HEVC, HEVC_NALU_t, HEVC_VCL_NALUS, scan_nalus, split_nalus, rewrite_packet
+from .video import Converter, ChangeGate
+from .ring import PacketRing
+from .session import Session, VideoState, AudioState
+
+# NALUs to pass through to KVS
+STREAM_NALUS = (NALU_t.SPS, NALU_t.PPS, NALU_t.IDR, NALU_t.NIDR)
+HEVC_STREAM_NALUS = (HEVC_NALU_t.VPS, HEVC_NALU_t.SPS, HEVC_NALU_t.PPS) + HEVC_VCL_NALUS
 
 NAMESPACES = {
     'SOAP-ENV': 'http://schemas.xmlsoap.org/soap/envelope/',
@@ -710,7 +718,7 @@ class API(object):
                         for req in HTTPRequestStreamDecoder.from_response(resp):
                             media, cc = req.headers['Content-Type'].split('/')
                             logging.debug(req.headers)
-                            if '264' in cc and req.headers['IsKeyFrame'] == 'true':
+                            if ('264' in cc or '265' in cc or 'hevc' in cc.lower()) and req.headers['IsKeyFrame'] == 'true':
                                 # XXX Sometimes a key frame contains no IDR but SEI from Crystal
                                 prev.append(req)
                                 prev_time = req.headers['IsKeyFrame']
@@ -1002,6 +1010,11 @@ class NUUOSource(AVSource):
             fps: preset FPS
             decoding: option to decode stream or not
             exact: area query to match exactly or not
+            pool: number of preallocated output arrays to reuse round robin or 0 to allocate per frame
+            scale: decoded frame (H, W) to scale to
+            roi: decoded frame (x, y, w, h) to crop before scaling
+            gate: suppress static frames by luma change of threshold, size and max_gap
+            ring: keep encoded packets of the last seconds within size bytes to export clips
 #           workaround: dealing with the last zero byte of PPS leading to three consecutive zero bytes
         """
         
@@ -1017,12 +1030,12 @@ class NUUOSource(AVSource):
                 stream = self.nvr.startStreaming(cfg, timeout=kwargs.pop('timeout', None))
 #                workaround = not decoding and '264' in codec
                 codec = av.CodecContext.create(codec, 'r')
-                session = dict(
+                session = Session(
                     stream=stream,
                     cam=cam,
                     profile=profile,
                     start=time(),
-                    video=dict(
+                    video=VideoState(
                         stream=stream,
                         type=None,
                         codec=codec,
@@ -1034,12 +1047,15 @@ class NUUOSource(AVSource):
                         time=0,
                         count=0,
                         keyframe=False,
+                        converter=Converter(scale=kwargs.get('scale', None), roi=kwargs.get('roi', None), pool=kwargs.get('pool', 0)),
+                        gate=ChangeGate.create(kwargs.get('gate', None)),
+                        ring=PacketRing.create(kwargs.get('ring', None)),
 #                        workaround=workaround,
                     ),
                 )
                 if with_audio:
                     # XXX Unknown audio codec yet
-                    session['audio'] = dict(
+                    session['audio'] = AudioState(
                         stream=stream,
                         type=None,
                         codec=None,
@@ -1062,13 +1078,15 @@ class NUUOSource(AVSource):
         r"""
         Args:
             timestamp(float): aboslute time from Crystal or now for Titan in UNIX time
+        Returns:
+            media, frame: frame is None if suppressed by the change gate
         """
-        media = session['video']
-        decoding = media['decoding']
-        media['time_base'] = time_base = packet.time_base or Fraction(1, 8000 * media['fps'])
+        media = session.video
+        decoding = media.decoding
+        media.time_base = time_base = packet.time_base or Fraction(1, 8000 * media.fps)
         if decoding:
-            codec = media['codec']
-            logging.debug(f"[{media['count']}] video/{media['type']} => {codec.name}")
+            codec = media.codec
+            logging.debug(f"[{media.count}] video/{media.type} => {codec.name}")
             try:
                 frames = codec.decode(packet)
                 assert len(frames) == 1, f"Only one frame at a time is expected but got {len(frames)} frames in one packet"
@@ -1077,47 +1095,47 @@ class NUUOSource(AVSource):
                 return None
             else:
                 frame = frames[0]
-                media['width'] = frame.width
-                media['height'] = frame.height
+                media.width, media.height = media.converter.geometry(frame.width, frame.height)
         else:
             # awslabs/amazon-kinesis-video-streams-producer-sdk-cpp#357
             # XXX NUUO NALU weird format of three consecutive zero bytes
-            NALUs = []
-            for (pos, _, _, type), nalu in h264.NALUParser(memoryview(packet), workaround=True):
-                # assert isValidNALU(nalu), f"frame[{meta['count']+1}] NALU(type={type}) at {pos} without START CODE: {nalu[:8].tobytes()}"
-                if type in (NALU_t.SPS, NALU_t.PPS, NALU_t.IDR, NALU_t.NIDR):
-                    NALUs.append(nalu)
-                    logging.debug(f"frame[{media['count']+1}] {NALU_t(type).name} at {pos}: {nalu[:8].tobytes()}")
-                else:
-                    logging.debug(f"frame[{media['count']+1}] skipped {NALU_t(type).name} at {pos}: {nalu[:8].tobytes()} ending with {nalu[-1:].tobytes()}")
-            packet = av.Packet(bytearray(b''.join(NALUs)))
+            codec = media.codec.name
+            nalus = scan_nalus(packet, workaround=True, codec=codec)
+            kept = np.isin(nalus['type'], codec in HEVC and HEVC_STREAM_NALUS or STREAM_NALUS)
+            NALUs = split_nalus(packet, nalus[kept])
+            if not kept.all():
+                for pos, _, end, type, _ in nalus[~kept].tolist():
+                    logging.debug(f"frame[{media.count+1}] skipped NALU(type={type}) at {pos}-{end}")
+            packet = rewrite_packet(packet, NALUs)
             frame = packet
 
-        duration = float((packet.duration or int(1 / time_base / media['fps'])) * time_base)
-        if media['count'] == 0:
-            media['count'] += 1
+        duration = float((packet.duration or int(1 / time_base / media.fps)) * time_base)
+        if media.count == 0:
+            media.count += 1
             logging.info(f"Assume absolute start timestamp={timestamp} to reset session start")
-            session['start'] = media['time0'] = timestamp
-            media['duration'] = duration
-            media['time'] = session['start'] # absolute or now
+            session.start = media.time0 = timestamp
+            media.duration = duration
+            media.time = session.start # absolute or now
         else:
-            media['count'] += 1
-            media['fps_rt'] = media['count'] / (time() - session['start'])
-            expected = media['time'] + media['duration']
+            media.count += 1
+            media.fps_rt = media.count / (time() - session.start)
+            expected = media.time + media.duration
             offset = (timestamp - expected) / 2
             offset = min(offset, duration / 2) if offset > 0 else max(offset, -duration / 2)
-            media['duration'] = duration + offset
-            media['time'] = session['start'] + (expected - media['time0'])
-            logging.debug(f"Adaptive frame duration: offet={offset:.3f}s, duration={media['duration']:.3f}s")
+            media.duration = duration + offset
+            media.time = session.start + (expected - media.time0)
+            logging.debug(f"Adaptive frame duration: offet={offset:.3f}s, duration={media.duration:.3f}s")
             logging.debug(f"media['time']=expected={expected:.3f}s, timestamp={timestamp:.3f}s")
 
+        if media.ring is not None:
+            media.ring.append(media.time, packet, media.keyframe)
+
         # dts/pts are made adaptive w.r.t. absolute media['time']
         if decoding:
-            format = media['format']
-            if format == 'BGR':
-                frame = frame.to_rgb().to_ndarray()[:,:,::-1]
-            elif format == 'RGB':
-                frame = frame.to_rgb().to_ndarray()
+            gate = media.gate
+            if gate is not None and not gate(frame, media.time):
+                return media, None
+            frame = media.converter(frame, media.format)
         return media, frame
     
     def process_audio(self, session, packet):
@@ -1152,7 +1170,9 @@ class NUUOSource(AVSource):
 
     def read(self, session, media=None, format='BGR'):
         """Read frames from NUUO stream.
+        Video frames suppressed by the change gate are skipped.
         """
+        desired = media
         stream = session['stream']
         while True:
             try:
@@ -1162,28 +1182,30 @@ class NUUOSource(AVSource):
                 raise e
             now = time()
             skip = False
-            if media is None:
+            if desired is None:
                 # Skip if not desired
                 skip = m not in session
-            elif media != m:
+            elif desired != m:
                 # Skip until desired
                 skip = True
             if skip:
-                logging.debug(f"Skpping {m}/{cc} until {media}")
+                logging.debug(f"Skpping {m}/{cc} until {desired}")
+                continue
+
+            media = session[m]
+            payload = pkt['payload']
+            packet = av.Packet(payload)
+            media['type'] = cc
+            media['keyframe'] = pkt['KeyFrame']
+            timestamp = pkt['time'] # from Crystal or now
+            if m == 'video':
+                media['format'] = format
+                res = self.process_video(session, packet, timestamp)
+                if res is not None and res[1] is None:
+                    # Suppressed by the change gate
+                    continue
+            elif m == 'audio':
+                res = self.process_audio(session, packet)
             else:
-                break
-
-        media = session[m]
-        payload = pkt['payload']
-        packet = av.Packet(payload)
-        media['type'] = cc
-        media['keyframe'] = pkt['KeyFrame']
-        timestamp = pkt['time'] # from Crystal or now
-        if m == 'video':
-            media['format'] = format
-            res = self.process_video(session, packet, timestamp)
-        elif m == 'audio':
-            res = self.process_audio(session, packet)
-        else:
-            raise ValueError(f"Unexpected reading '{m}'")
-        return res and (m, *res)
\ No newline at end of file
+                raise ValueError(f"Unexpected reading '{m}'")
+            return res and (m, *res)
\ No newline at end of file
@@ -0,0 +1,192 @@
+# Copyright (c) 2017-present, NEC Laboratories America, Inc. ("NECLA").
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from ml import av, logging
+from .index import load_index
+from .video import INTRA_CODECS, Converter
+
+def decode_chunk(path, start, end, pts, origin, fps, format='BGR', scale=None, roi=None):
+    '''Decode packets [start, end) in demux order of a GOP aligned chunk in a worker process.
+
+    Args:
+        path(str): local video file path
+        start(int): packet count of the key frame to start from
+        end(int): packet count of the next chunk
+        pts(int): key frame pts to seek to or None to skip packets
+        origin(int): pts of the first key frame in the file
+        fps(float): nominal FPS for frames without pts
+    Returns:
+        frames(List[Tuple[dict, np.ndarray]]): (meta, frame) in presentation order
+    '''
+    converter = Converter(scale=scale, roi=roi)
+    frames = []
+    with av.open(path) as source:
+        video0 = source.streams.video[0]
+        codec = video0.codec_context
+        time_base = video0.time_base
+        skip = 0
+        if pts is None:
+            skip = start
+        else:
+            source.seek(pts, stream=video0, backward=True, any_frame=False)
+
+        def emit(decoded):
+            for frame in decoded:
+                count = start + len(frames)
+                if frame.pts is None or origin is None:
+                    t = count / fps
+                else:
+                    t = float((frame.pts - origin) * time_base)
+                meta = dict(
+                    count=count + 1,
+                    time=t,
+                    duration=1 / fps,
+                    keyframe=bool(frame.key_frame),
+                )
+                frames.append((meta, converter(frame, format)))
+
+        count = start
+        for pkt in source.demux(video0):
+            if pkt.size == 0:
+                continue
+            if skip > 0:
+                skip -= 1
+                continue
+            if count >= end:
+                break
+            emit(codec.decode(pkt))
+            count += 1
+        # Flush frames delayed by reordering
+        emit(codec.decode(None))
+    return frames[:end - start]
+
+def parallel_read(path, workers=None, format='BGR', chunk=1, inflight=None, scale=None, roi=None):
+    '''Decode a local video file in GOP aligned chunks across worker processes.
+
+    Chunks are split at key frames from the keyframe index and decoded concurrently
+    while frames are yielded in order. At most `inflight` chunks are decoded or
+    buffered at a time to bound memory to about inflight x GOP frames.
+
+    Args:
+        path(str): local video file path
+        workers(int): number of worker processes, default to the number of CPUs
+        format(str): BGR | RGB | GRAY
+        chunk(int): number of GOPs per chunk
+        inflight(int): max chunks in flight, default to one more than the workers
+        scale(Tuple[int, int]): decoded frame (H, W) to scale to
+        roi(Tuple[int, int, int, int]): decoded frame (x, y, w, h) to crop before scaling
+    Yields:
+        (meta, frame): meta of count, time in secs from the first frame, duration and keyframe
+    '''
+    path = str(path)
+    index = load_index(path)
+    gops = index.gops()
+    origin = index.pts[0]
+    chunks = [(gops[i][0], gops[min(i + chunk, len(gops)) - 1][1], index.pts[i]) for i in range(0, len(gops), chunk)]
+    workers = workers or os.cpu_count()
+    inflight = inflight or workers + 1
+    logging.info(f"Decoding {index.frames} frames of {path} in {len(chunks)} chunks by {workers} workers")
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    pending = deque()
+    chunks = iter(chunks)
+    def submit():
+        for start, end, pts in chunks:
+            pending.append(executor.submit(decode_chunk, path, start, end, pts, origin, index.fps, format, scale, roi))
+            return True
+        return False
+
+    try:
+        for _ in range(inflight):
+            if not submit():
+                break
+        while pending:
+            frames = pending.popleft().result()
+            submit()
+            yield from frames
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+class ParallelDecoder(object):
+    '''Order preserving thread pool decoder of intra-only video such as MJPEG.
+
+    Each worker decodes and converts with its own codec context and converter since frames are independent.
+    Converted arrays are allocated per frame as pooled arrays may still be in flight.
+    '''
+
+    def __init__(self, codec, workers=None, scale=None, roi=None):
+        '''
+        Args:
+            codec(av.CodecContext): session codec context to create worker decoders like
+            workers(int): number of worker threads, default to the number of CPUs
+            scale(Tuple[int, int]): decoded frame (H, W) to scale to
+            roi(Tuple[int, int, int, int]): decoded frame (x, y, w, h) to crop before scaling
+        '''
+        self.name = codec.name
+        self.extradata = codec.extradata
+        self.workers = workers or os.cpu_count()
+        self.scale = scale
+        self.roi = roi
+        # Output geometry only as converters keep per thread filter graphs to crop
+        self.converter = Converter(scale=scale, roi=roi)
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ParallelDecoder')
+        self.pending = deque()
+
+    def __len__(self):
+        return len(self.pending)
+
+    @property
+    def full(self):
+        return len(self.pending) >= self.workers
+
+    def decode(self, pkt, format='BGR'):
+        local = self.local
+        codec = getattr(local, 'codec', None)
+        if codec is None:
+            codec = local.codec = av.CodecContext.create(self.name, 'r')
+            if self.extradata is not None:
+                codec.extradata = self.extradata
+            local.converter = Converter(scale=self.scale, roi=self.roi)
+        frames = codec.decode(pkt)
+        if not frames:
+            return None, None
+        frame = frames[0]
+        if format is None:
+            return frame, frame
+        return frame, local.converter(frame, format)
+
+    def submit(self, pkt, format='BGR', *args):
+        '''Decode a packet in a worker with any args to return in order along with the result.
+        '''
+        self.pending.append((self.executor.submit(self.decode, pkt, format), args))
+
+    def next(self):
+        '''
+        Returns:
+            (frame, converted, *args): decoded frame, converted array and args of the earliest packet submitted
+        '''
+        future, args = self.pending.popleft()
+        return (*future.result(), *args)
+
+    def reset(self):
+        '''Discard packets submitted but not returned yet as on seeking or reconnecting.
+        '''
+        for future, _ in self.pending:
+            future.cancel()
+        self.pending.clear()
+
+    def close(self):
+        self.reset()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,118 @@
+# Copyright (c) 2017-present, NEC Laboratories America, Inc. ("NECLA").
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory
+
+import time
+from queue import Queue, Full, Empty
+
+from ml import logging
+from ..ws.executor import Executor
+
+EOS = object()
+
+class Prefetcher(Executor):
+    '''Run a session framer in a worker thread feeding a bounded queue.
+
+    The framer works on a shadow copy of the session media state so that the
+    consumer only sees the state snapshot of the frame it has just read.
+    Iterating the prefetcher yields the same (meta, frame) as the framer.
+    '''
+
+    def __init__(self, session, media, framer, size, name=None):
+        '''
+        Args:
+            session(dict): streaming session from open()
+            media(str): 'video' | 'audio'
+            framer(Callable): session => generator of (meta, frame)
+            size(int): max number of frames to prefetch
+        '''
+        super(Prefetcher, self).__init__(name or f"Prefetcher[{media}]")
+        self.session = session
+        self.media = media
+        self.shadow = session.copy()
+        self.shadow[media] = state = session[media].copy()
+        state.pop('framer', None)
+        self.framer = framer(self.shadow)
+        self.queue = Queue(maxsize=size)
+        self.stats = dict(
+            size=size,
+            depth=0,            # queue depth on last read
+            max_depth=0,
+            mean_depth=0,
+            frames=0,
+            blocked_put=0,      # secs the worker is blocked by a slow consumer
+            blocked_get=0,      # secs the consumer is blocked by a slow source
+        )
+        session[media].setdefault('stats', {})['prefetch'] = self.stats
+        self.start()
+
+    def put(self, item):
+        start = time.time()
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+            except Full:
+                continue
+            else:
+                self.stats['blocked_put'] += time.time() - start
+                return True
+        return False
+
+    def run(self):
+        try:
+            for meta, frame in self.framer:
+                snapshot = dict(meta)
+                if not self.put((self.shadow['start'], snapshot, frame)):
+                    break
+            else:
+                self.put(EOS)
+        except Exception as e:
+            logging.error(f"{self.name} failed to read a frame: {e}")
+            self.put(e)
+        finally:
+            self.framer.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        stats = self.stats
+        depth = self.queue.qsize()
+        start = time.time()
+        item = self.queue.get()
+        stats['blocked_get'] += time.time() - start
+        if item is EOS:
+            self.queue.put(EOS)
+            raise StopIteration
+        elif isinstance(item, Exception):
+            self.queue.put(item)
+            raise item
+
+        stats['frames'] += 1
+        stats['depth'] = depth
+        stats['max_depth'] = max(stats['max_depth'], depth)
+        stats['mean_depth'] += (depth - stats['mean_depth']) / stats['frames']
+        start, snapshot, frame = item
+        self.session['start'] = start
+        meta = self.session[self.media]
+        meta.update(snapshot)
+        return meta, frame
+
+    def close(self, timeout=10):
+        if not self.running:
+            return
+        self.running = False
+        self.stop_event.set()
+        # Unblock the worker if waiting on a full queue
+        try:
+            while True:
+                self.queue.get_nowait()
+        except Empty:
+            pass
+        self._runner.join(timeout=timeout)
+        if self._runner.is_alive():
+            logging.warning(f"{self.name} not stopped in {timeout}s")
+        self._runner = None
@@ -20,6 +20,18 @@ DEFAULT_BUFFER_DURATION         = 120 * HUNDREDS_OF_NANOS_SEC
 DEFAULT_KEY_FRAME_INTERVAL      = 15
 DEFAULT_FPS_VALUE               = 15
 
+# MKV codec IDs of the video track by FFMPEG codec names
+MKV_CODEC_IDS = dict(
+    h264='V_MPEG4/ISO/AVC',
+    hevc='V_MPEGH/ISO/HEVC',
+)
+
+# Content types of the MKV video track by codec
+MKV_CONTENT_TYPES = dict(
+    h264='video/h264',
+    hevc='video/h265',
+)
+
 
 class KVProducer(object):
     def __init__(self, accessKey=None, secretKey=None, region=None):
@@ -33,10 +45,17 @@ class KVProducer(object):
         self.accessKey = accessKey or secret.get('AWS_ACCESS_KEY_ID', ffi.NULL)
         self.secretKey = secretKey or secret.get('AWS_SECRET_ACCESS_KEY', ffi.NULL)
         self.privateKey = secret.get('PRIVATE_KEY', None)
+        self.codec = 'h264'
        
-    def connect(self, streamName, region=ffi.NULL, sessionToken=ffi.NULL, cacertPath=ffi.NULL):
+    def connect(self, streamName, region=ffi.NULL, sessionToken=ffi.NULL, cacertPath=ffi.NULL, codec='h264'):
         '''Connect to KVS as the streaming sink.
+
+        Args:
+            codec(str): h264 | hevc video track to upload Annex B frames of
         '''
+        if codec not in MKV_CODEC_IDS:
+            raise ValueError(f"Unsupported codec {codec} not in {tuple(MKV_CODEC_IDS)}")
+        self.codec = codec
         self.streamName = streamName
         self.region = region or os.getenv('AWS_DEFAULT_REGION', DEFAULT_AWS_REGION)
         self.sessionToken = sessionToken or os.getenv('AWS_SESSION_TOKEN', ffi.NULL)
@@ -61,6 +80,14 @@ class KVProducer(object):
                                                         ffi.cast('PStreamInfo*', ppStreamInfo))
         assert ret == 0, f"createRealtimeVideoStreamInfoProvider(...) failed with ret: {ret}"
         self.pStreamInfo = ppStreamInfo[0]
+        if codec != 'h264':
+            # Default video track in H.264
+            streamCaps = self.pStreamInfo.streamCaps
+            codecId = MKV_CODEC_IDS[codec].encode()
+            contentType = MKV_CONTENT_TYPES[codec].encode()
+            ffi.memmove(streamCaps.trackInfoList[0].codecId, codecId + b'\0', len(codecId) + 1)
+            ffi.memmove(streamCaps.contentType, contentType + b'\0', len(contentType) + 1)
+            logging.info(f"Video track codecId={ffi.string(streamCaps.trackInfoList[0].codecId).decode()}, contentType={ffi.string(streamCaps.contentType).decode()}")
         print(f"Default streamCaps.bufferDuration={self.pStreamInfo.streamCaps.bufferDuration}")
         print(f"Default streamCaps.frameRate={self.pStreamInfo.streamCaps.frameRate}")
         print(f"Default streamCaps.fragmentAcks={self.pStreamInfo.streamCaps.fragmentAcks}")
@@ -187,6 +214,11 @@ class KVProducer(object):
         sessions = self.open(*args, **kwargs)
         assert len(sessions) == 1, f"Only one streaming session at a time but got {len(sessions)} sessions"
         session = sessions.pop()
+        codec = session['video']['codec'].name
+        if codec != self.codec:
+            logging.error(f"Source video in {codec} inconsistent with the KVS video track in {self.codec}")
+            self.close(session)
+            return
 
         # Streaming duration if any
         streamStartTime = lib.defaultGetTime()
@@ -219,16 +251,16 @@ class KVProducer(object):
                     break
 
             m, media, frame = res
-            keyframe = media['keyframe']
+            keyframe = media.keyframe
             offset = 0
             # XXX Why SEI is the very 1st NALU can be due to SPS/PPS saved in extradata
             pFrame.flags = ffi.integer_const('FRAME_FLAG_KEY_FRAME') if keyframe else ffi.integer_const('FRAME_FLAG_NONE')
             pFrame.frameData = ffi.cast('void*', frame.buffer_ptr + offset)
             pFrame.size = frame.size - offset
-            pFrame.index = media['count']
-            pFrame.presentationTs = pFrame.decodingTs = max(int(media['time'] * HUNDREDS_OF_NANOS_SEC), pFrame.decodingTs+pFrame.duration) 
-            pFrame.duration = int(media['duration'] * HUNDREDS_OF_NANOS_SEC)
-            print(f"Sending {'key ' if keyframe else ''}frame[{media['count']}] of duration {media['duration']:.3f}s to KVS with timestamp {media['time']:.3f}s at {now / HUNDREDS_OF_NANOS_SEC:.3f}s", )
+            pFrame.index = media.count
+            pFrame.presentationTs = pFrame.decodingTs = max(int(media.time * HUNDREDS_OF_NANOS_SEC), pFrame.decodingTs+pFrame.duration) 
+            pFrame.duration = int(media.duration * HUNDREDS_OF_NANOS_SEC)
+            print(f"Sending {'key ' if keyframe else ''}frame[{media.count}] of duration {media.duration:.3f}s to KVS with timestamp {media.time:.3f}s at {now / HUNDREDS_OF_NANOS_SEC:.3f}s", )
             ret = lib.putKinesisVideoFrame(self.streamHandle, pFrame)
             if ret > 0:
                 logging.error(f"Failed to send a frame to KVS with ret={ret:#04x}")
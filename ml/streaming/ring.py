@@ -0,0 +1,147 @@
+# Copyright (c) 2017-present, NEC Laboratories America, Inc. ("NECLA").
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory
+
+from fractions import Fraction
+from threading import Lock
+from collections import deque
+
+from ml import av, logging
+
+# Packet time base to remux clips in
+CLIP_TIME_BASE = Fraction(1, 1000)
+
+class PacketRing(object):
+    '''Ring buffer of encoded video packets bounded by secs and bytes.
+
+    The buffer always starts at a key frame by evicting whole GOPs.
+    It covers at least the last `seconds` unless that takes more than `size` bytes.
+    A GOP larger than `size` on its own is dropped until the next key frame.
+    '''
+
+    def __init__(self, seconds=30, size=64 * 2**20):
+        '''
+        Args:
+            seconds(float): secs of packets to keep
+            size(int): max bytes of packets to keep
+        '''
+        self.seconds = seconds
+        self.size = size
+        self.packets = deque()      # (time, keyframe, packet)
+        self.keyframes = deque()    # key frame times
+        self.lock = Lock()
+        self.stats = dict(
+            packets=0,
+            bytes=0,
+            max_bytes=0,
+            seconds=0,
+            evicted=0,              # packets evicted by bounds
+        )
+
+    def evict(self):
+        '''Evict the oldest GOP.
+        '''
+        packets = self.packets
+        stats = self.stats
+        self.keyframes.popleft()
+        while True:
+            _, _, packet = packets.popleft()
+            stats['bytes'] -= packet.size
+            stats['evicted'] += 1
+            if not packets or packets[0][1]:
+                break
+
+    def append(self, time, packet, keyframe):
+        '''
+        Args:
+            time(float): frame time in secs
+            packet(av.Packet): encoded packet to keep by reference
+            keyframe(bool): whether the packet is a key frame
+        '''
+        packets = self.packets
+        stats = self.stats
+        if not packets and not keyframe:
+            stats['evicted'] += 1
+            return
+        with self.lock:
+            packets.append((time, keyframe, packet))
+            stats['bytes'] += packet.size
+            if keyframe:
+                self.keyframes.append(time)
+                # Evict the oldest GOP if the rest still covers the seconds
+                keyframes = self.keyframes
+                while len(keyframes) > 1 and keyframes[1] <= time - self.seconds:
+                    self.evict()
+            while packets and stats['bytes'] > self.size:
+                self.evict()
+            stats['packets'] = len(packets)
+            stats['max_bytes'] = max(stats['max_bytes'], stats['bytes'])
+            stats['seconds'] = packets and packets[-1][0] - packets[0][0] or 0
+
+    def clip(self, t0, t1):
+        '''Packets from the last key frame at or before t0 through t1.
+        '''
+        start = 0
+        clip = []
+        with self.lock:
+            for t, keyframe, packet in self.packets:
+                if t > t1:
+                    break
+                if keyframe and t <= t0:
+                    start = len(clip)
+                clip.append((t, keyframe, packet))
+        return clip[start:]
+
+    @classmethod
+    def create(cls, ring):
+        '''Ring from a session option of None, True for defaults or a dict of seconds and size.
+        '''
+        if not ring:
+            return None
+        return cls() if ring is True else cls(**ring)
+
+def export_clip(packets, path, template=None, codec=None, width=None, height=None, format=None):
+    '''Remux ring buffer packets to a file without decoding.
+
+    Annex B packets must be exported without a template of avcC/hvcC extradata.
+    The muxer then takes the parameter sets from the first key frame and converts them.
+
+    Args:
+        packets(List[Tuple[float, bool, av.Packet]]): packets from PacketRing.clip()
+        path(str): output path of a container such as MP4/MKV
+        template(av.VideoStream): input stream to copy codec parameters from
+        codec(str): codec name if no template
+        width(int): frame width if no template
+        height(int): frame height if no template
+        format(str): container format or by the path extension
+    Returns:
+        secs of the clip exported
+    '''
+    if not packets:
+        raise ValueError(f"No packets to export to {path}")
+    with av.open(str(path), 'w', format=format) as output:
+        if template is None:
+            stream = output.add_stream(codec)
+            if width and height:
+                stream.width = width
+                stream.height = height
+        else:
+            stream = output.add_stream(template=template)
+        t0 = packets[0][0]
+        for t, keyframe, pkt in packets:
+            packet = av.Packet(pkt)
+            packet.dts = round((t - t0) / CLIP_TIME_BASE)
+            packet.pts = packet.dts
+            if pkt.pts is not None and pkt.dts is not None and pkt.time_base:
+                # Keep the reordering delay if any
+                packet.pts += round((pkt.pts - pkt.dts) * pkt.time_base / CLIP_TIME_BASE)
+            packet.time_base = CLIP_TIME_BASE
+            packet.is_keyframe = keyframe
+            packet.stream = stream
+            output.mux(packet)
+    duration = packets[-1][0] - t0
+    logging.info(f"Exported {len(packets)} packets of {duration:.3f}s to {path}")
+    return duration
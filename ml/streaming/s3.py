@@ -12,7 +12,7 @@ def get_s3_video(url, *args, transcode=False, bucket='eigen-stream-videos', pth=
     Download video from s3 and transcode
     params: 
         url - s3 key name
-        transcode - transcode video to h264
+        transcode - transcode video to h264 in Annex B by ffmpeg, unnecessary to stream AVCC packets converted in process
         bucket - s3 key bucket
     Returns:
         video path or url(str)
@@ -0,0 +1,186 @@
+# Copyright (c) 2017-present, NEC Laboratories America, Inc. ("NECLA").
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory
+
+from collections.abc import MutableMapping
+
+class State(MutableMapping):
+    '''Slotted state with a dict-compatible mapping interface.
+
+    Known fields are slots to read and write as attributes in per-frame paths.
+    Other keys go to an extra dict allocated on demand.
+    Unset fields are missing keys as in a dict.
+    '''
+
+    __slots__ = ('_extra',)
+    FIELDS = frozenset()
+    ORDER = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        fields = []
+        for klass in reversed(cls.__mro__):
+            fields.extend(name for name in klass.__dict__.get('__slots__', ()) if name != '_extra')
+        cls.ORDER = tuple(fields)
+        cls.FIELDS = frozenset(fields)
+
+    def __init__(self, *args, **kwargs):
+        self._extra = None
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        if key in self.FIELDS:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for name in self.ORDER:
+            if hasattr(self, name):
+                yield name
+        if self._extra is not None:
+            yield from list(self._extra)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            return getattr(self, key, default)
+        return default if self._extra is None else self._extra.get(key, default)
+
+    def clear(self):
+        for name in self.ORDER:
+            if hasattr(self, name):
+                delattr(self, name)
+        self._extra = None
+
+    def copy(self):
+        '''Shallow copy of the same type.
+        '''
+        return type(self)(self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)})"
+
+class MediaState(State):
+    '''Common state of a session media stream.
+    '''
+
+    __slots__ = (
+        'stream',
+        'start',
+        'format',
+        'codec',
+        'decoding',
+        'type',
+        'count',
+        'time',
+        'duration',
+        'keyframe',
+        'framer',
+        'stats',
+        'time_base',
+        'pts',
+        'dts',
+    )
+
+class VideoState(MediaState):
+    '''Video state of a session read and written per frame.
+    '''
+
+    __slots__ = (
+        'width',
+        'height',
+        'fps',
+        'fps_rt',
+        'time0',
+        'drifting',
+        'adaptive',
+        'workaround',
+        'thresholds',
+        'prev',
+        'prefetch',
+        'replay',
+        'end',
+        'anchor',
+        'converter',
+        'sink',
+        'policy',
+        'decoder',
+        'threads',
+        'gate',
+        'mvgrid',
+        'motion',
+        'ring',
+        'snapshots',
+        'jitter',
+        'reconnect',
+        'resync',
+        'offset',
+        'cpd',
+        'avcc',
+        'index',
+        'batches',
+    )
+
+class AudioState(MediaState):
+    '''Audio state of a session.
+    '''
+
+    __slots__ = (
+        'sample_rate',
+        'channels',
+    )
+
+class Session(State):
+    '''Streaming session of the source, stream and start time with video and audio states.
+    '''
+
+    __slots__ = (
+        'src',
+        'streams',
+        'stream',
+        'format',
+        'decoding',
+        'start',
+        'origin',
+        'rt',
+        'opened',
+        'reopen',
+        'cam',
+        'profile',
+        'video',
+        'audio',
+    )
@@ -0,0 +1,126 @@
+# Copyright (c) 2017-present, NEC Laboratories America, Inc. ("NECLA").
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory
+
+from fractions import Fraction
+from threading import Lock
+from collections import deque
+
+from ml import av, logging
+from .video import PIXEL_FORMATS, to_ndarray
+
+# Image formats to encoders and pixel formats
+IMAGE_FORMATS = dict(
+    jpeg=('mjpeg', 'yuvj420p'),
+    png=('png', 'rgb24'),
+)
+
+def encode_image(frame, format='jpeg', size=None):
+    '''Encode a decoded video frame as a JPEG/PNG image.
+
+    Args:
+        frame(av.VideoFrame): decoded frame
+        format(str): jpeg | png
+        size(Tuple[int, int]): optional (H, W) to scale to
+    Returns:
+        image(bytes): encoded image
+    '''
+    name, pix_fmt = IMAGE_FORMATS[format]
+    height, width = size or (frame.height, frame.width)
+    codec = av.CodecContext.create(name, 'w')
+    codec.width = width
+    codec.height = height
+    codec.pix_fmt = pix_fmt
+    codec.time_base = Fraction(1, 25)
+    packets = codec.encode(frame.reformat(width=width, height=height, format=pix_fmt))
+    packets += codec.encode(None)
+    return b''.join(bytes(packet) for packet in packets)
+
+class SnapshotCache(object):
+    '''Latest key frames of a session to serve snapshots from memory.
+
+    Decoding sessions keep decoded key frames as is.
+    Otherwise, key frame packets are kept to decode only on request.
+    Encoded snapshots are cached until the next key frame arrives.
+    '''
+
+    def __init__(self, seconds=0):
+        '''
+        Args:
+            seconds(float): secs of key frames to keep before the latest one
+        '''
+        self.seconds = seconds
+        self.keyframes = deque()    # (time, av.VideoFrame | av.Packet)
+        self.decoder = None
+        self.cache = {}
+        self.lock = Lock()
+
+    def update(self, time, keyframe):
+        '''Keep a decoded key frame or a key frame packet.
+        '''
+        keyframes = self.keyframes
+        with self.lock:
+            keyframes.append((time, keyframe))
+            while keyframes[0][0] < time - self.seconds:
+                keyframes.popleft()
+            self.cache.clear()
+
+    def setup(self, name, extradata=None):
+        '''Separate decoder of key frame packets by the session codec name and extradata if out of band.
+        '''
+        self.decoder = decoder = av.CodecContext.create(name, 'r')
+        if extradata is not None:
+            decoder.extradata = extradata
+
+    def decode(self, keyframe):
+        if isinstance(keyframe, av.VideoFrame):
+            return keyframe
+        decoder = self.decoder
+        frames = decoder.decode(keyframe)
+        if not frames:
+            # Drain the delayed frame and restart with a fresh decoder
+            frames = decoder.decode(None)
+            self.setup(decoder.name, decoder.extradata)
+        return frames[0]
+
+    def snapshot(self, format='jpeg', size=None, time=None):
+        '''
+        Args:
+            format(str): jpeg | png | BGR | RGB | GRAY
+            size(Tuple[int, int]): optional (H, W) to scale to
+            time(float): latest key frame at or before the time or the latest key frame if None
+        Returns:
+            (time, image) of bytes or np.ndarray or None if no key frame yet
+        '''
+        with self.lock:
+            if not self.keyframes:
+                return None
+            t, keyframe = self.keyframes[-1]
+            if time is not None:
+                for t, keyframe in reversed(self.keyframes):
+                    if t <= time:
+                        break
+            key = (t, format, size and tuple(size))
+            image = self.cache.get(key, None)
+            if image is None:
+                frame = self.decode(keyframe)
+                if format in IMAGE_FORMATS:
+                    image = encode_image(frame, format, size)
+                elif format in PIXEL_FORMATS:
+                    image = to_ndarray(frame, format, size)
+                else:
+                    raise ValueError(f"Unsupported snapshot format: {format}")
+                self.cache[key] = image
+                logging.debug(f"Cached snapshot {key}")
+            return t, image
+
+    @classmethod
+    def create(cls, snapshots):
+        '''Cache from a session option of None, True for the latest key frame or a dict of seconds.
+        '''
+        if not snapshots:
+            return None
+        return cls() if snapshots is True else cls(**snapshots)
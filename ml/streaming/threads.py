@@ -0,0 +1,147 @@
+# Copyright (c) 2017-present, NEC Laboratories America, Inc. ("NECLA").
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory
+
+import os
+import heapq
+from itertools import count
+from threading import Lock
+
+from ml import logging
+
+def thread_type(threads, delay=False):
+    '''FFMPEG thread type of a decoder by the number of threads and whether output delay is tolerated.
+
+    Frame threads scale regardless of slices but delay the output by one frame per extra thread.
+    Slice threads keep decoding in step with packets.
+    '''
+    return 'FRAME' if threads > 1 and delay else 'SLICE'
+
+def configure(codec, threads, delay=False):
+    '''Set the thread count and type of a decoder before it opens.
+
+    Returns:
+        whether configured or False if the decoder is already open
+    '''
+    if codec.is_open:
+        return False
+    codec.thread_count = threads
+    codec.thread_type = thread_type(threads, delay)
+    return True
+
+class DecodeThreads(object):
+    '''Process-wide budget of decoder threads shared by concurrent decoding sessions.
+
+    Threads are given one at a time to the session of the highest pixel rate per thread
+    with at least one for each and at most one per `pixels` of its resolution.
+    The budget is rebalanced whenever sessions open or close.
+    Decoders take their threads only before opening since FFMPEG fixes threading on open.
+    '''
+
+    def __init__(self, threads=None, pixels=640 * 360, max_threads=16):
+        '''
+        Args:
+            threads(int): total decoder threads, default to the number of CPUs
+            pixels(int): min pixels per frame for each thread of a session
+            max_threads(int): max threads per session
+        '''
+        self.threads = threads or os.cpu_count()
+        self.pixels = pixels
+        self.max_threads = max_threads
+        self.sessions = {}
+        self.keys = count(1)
+        self.lock = Lock()
+
+    def cap(self, session):
+        width, height = session['width'] or 0, session['height'] or 0
+        return max(1, min(self.max_threads, width * height // self.pixels))
+
+    def rebalance(self):
+        '''Reallocate the budget to the registered sessions.
+        '''
+        sessions = self.sessions
+        for session in sessions.values():
+            session['threads'] = 1
+            session['type'] = thread_type(1, session['delay'])
+        spare = self.threads - len(sessions)
+        heap = [(-session['rate'], key) for key, session in sessions.items() if self.cap(session) > 1]
+        heapq.heapify(heap)
+        while spare > 0 and heap:
+            _, key = heapq.heappop(heap)
+            session = sessions[key]
+            session['threads'] += 1
+            session['type'] = thread_type(session['threads'], session['delay'])
+            spare -= 1
+            if session['threads'] < self.cap(session):
+                heapq.heappush(heap, (-session['rate'] / session['threads'], key))
+        logging.debug(f"Rebalanced {self.threads} decoder threads to {len(sessions)} sessions")
+
+    def register(self, codec, width, height, fps=None, delay=False):
+        '''Register a decoding session to rebalance the budget and configure its decoder.
+
+        Args:
+            codec(av.CodecContext): video decoder not open yet
+            width(int): frame width
+            height(int): frame height
+            fps(float): nominal FPS to weigh the pixel rate by
+            delay(bool): whether the session tolerates the output delay of frame threads
+        Returns:
+            key(int): session key to unregister
+        '''
+        with self.lock:
+            key = next(self.keys)
+            self.sessions[key] = dict(
+                codec=codec.name,
+                width=width,
+                height=height,
+                fps=fps,
+                delay=delay,
+                rate=(width or 0) * (height or 0) * (fps or 1),
+                threads=1,
+                type='SLICE',
+                applied=None,           # threads the decoder is configured with
+            )
+            self.rebalance()
+            self.apply(key, codec)
+            return key
+
+    def unregister(self, key):
+        with self.lock:
+            if self.sessions.pop(key, None) is not None:
+                self.rebalance()
+
+    def resize(self, threads):
+        '''Change the total decoder threads to rebalance.
+        '''
+        with self.lock:
+            self.threads = threads
+            self.rebalance()
+
+    def apply(self, key, codec):
+        '''Configure a decoder not open yet with the threads allocated to the session.
+        '''
+        session = self.sessions.get(key, None)
+        if session is None or not configure(codec, session['threads'], session['delay']):
+            return False
+        session['applied'] = session['threads']
+        return True
+
+    def stale(self, key):
+        '''Whether the session decoder is configured with other than its allocated threads.
+        '''
+        session = self.sessions.get(key, None)
+        return session is not None and session['applied'] != session['threads']
+
+    def allocation(self):
+        '''
+        Returns:
+            sessions(Dict[int, dict]): codec, width, height, fps, delay, threads, type and applied threads by session key
+        '''
+        with self.lock:
+            return {key: dict(session) for key, session in self.sessions.items()}
+
+# Shared by all sessions in the process
+THREADS = DecodeThreads()
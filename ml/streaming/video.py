@@ -0,0 +1,333 @@
+# Copyright (c) 2017-present, NEC Laboratories America, Inc. ("NECLA").
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory
+
+from fractions import Fraction
+
+import numpy as np
+
+from ml import av
+from .nalu import is_reference
+
+# Intra-only codecs with every frame independently decodable
+INTRA_CODECS = ('mjpeg', 'jpegls', 'jpeg2000')
+
+# Output formats to FFMPEG pixel formats
+PIXEL_FORMATS = dict(
+    BGR='bgr24',
+    RGB='rgb24',
+    GRAY='gray',
+)
+
+class FramePool(object):
+    '''Round robin pool of preallocated contiguous output arrays.
+
+    A pooled array is overwritten after `size` more frames are converted.
+    '''
+
+    def __init__(self, size=2):
+        self.size = size
+        self.arrays = []
+        self.index = 0
+
+    def next(self, shape, dtype=np.uint8):
+        if not self.arrays or self.arrays[0].shape != shape or self.arrays[0].dtype != dtype:
+            self.arrays = [np.empty(shape, dtype=dtype) for _ in range(self.size)]
+            self.index = 0
+        array = self.arrays[self.index]
+        self.index = (self.index + 1) % self.size
+        return array
+
+def to_ndarray(frame, format='BGR', size=None, pool=None, out=None):
+    '''Convert a decoded video frame straight into a C-contiguous array of the requested format.
+
+    Args:
+        frame(av.VideoFrame): decoded frame
+        format(str): BGR | RGB | GRAY
+        size(Tuple[int, int]): optional output (H, W) to scale to
+        pool(FramePool): optional pool to take the output array from
+        out(np.ndarray): optional output array to convert into
+    Returns:
+        array(np.ndarray): HxWx3 for BGR/RGB or HxW for GRAY
+    '''
+    height, width = size or (None, None)
+    frame = frame.reformat(width=width, height=height, format=PIXEL_FORMATS[format])
+    array = frame.to_ndarray()
+    if out is None and pool is not None:
+        out = pool.next(array.shape, array.dtype)
+    if out is not None:
+        np.copyto(out, array)
+        return out
+    # XXX copy only if the line size is padded
+    return np.ascontiguousarray(array)
+
+class Converter(object):
+    '''Per session video frame conversion with optional ROI cropping and scaling.
+
+    The ROI is cropped before scaling and pixel format conversion so that
+    only the pixels in need are produced by swscale.
+    '''
+
+    def __init__(self, scale=None, roi=None, pool=0):
+        '''
+        Args:
+            scale(Tuple[int, int]): output (H, W) as RTSP_CONFIG.scale
+            roi(Tuple[int, int, int, int]): (x, y, w, h) to crop
+            pool(int): number of preallocated output arrays or 0 to allocate per frame
+        '''
+        self.scale = scale and tuple(scale) or None
+        self.roi = roi and tuple(roi) or None
+        self.pool = pool and FramePool(pool) or None
+        self.graph = None
+
+    def geometry(self, width, height):
+        '''Output (width, height) given the decoded frame resolution.
+        '''
+        if self.scale:
+            height, width = self.scale
+        elif self.roi:
+            x, y, w, h = self.roi
+            width, height = min(w, width - x), min(h, height - y)
+        return width, height
+
+    def crop(self, frame):
+        '''Crop the ROI clamped to the frame as geometry().
+        '''
+        key = (frame.width, frame.height, frame.format.name)
+        if self.graph is None or self.graph[0] != key:
+            x, y, w, h = self.roi
+            w, h = min(w, frame.width - x), min(h, frame.height - y)
+            if x < 0 or y < 0 or w <= 0 or h <= 0:
+                raise ValueError(f"ROI{self.roi} out of the frame of {frame.width}x{frame.height}")
+            graph = av.filter.Graph()
+            src = graph.add_buffer(width=frame.width, height=frame.height, format=frame.format.name, time_base=Fraction(1, 1000))
+            crop = graph.add('crop', f"{w}:{h}:{x}:{y}")
+            sink = graph.add('buffersink')
+            src.link_to(crop)
+            crop.link_to(sink)
+            graph.configure()
+            # XXX filter contexts do not keep the graph alive
+            self.graph = (key, graph, src, sink)
+        _, _, src, sink = self.graph
+        src.push(frame)
+        return sink.pull()
+
+    def __call__(self, frame, format='BGR', out=None):
+        '''Convert a decoded frame to an array in BGR | RGB | GRAY or keep as is in other formats.
+        '''
+        if self.roi:
+            frame = self.crop(frame)
+        if format in PIXEL_FORMATS:
+            return to_ndarray(frame, format, size=self.scale, pool=self.pool, out=out)
+        elif self.scale:
+            height, width = self.scale
+            return frame.reformat(width=width, height=height)
+        return frame
+
+# 8-bit pixel formats with the luma plane first
+LUMA8_FORMATS = frozenset((
+    'gray',
+    'nv12', 'nv21', 'nv16',
+    'yuv410p', 'yuv411p', 'yuv420p', 'yuv422p', 'yuv440p', 'yuv444p',
+    'yuvj411p', 'yuvj420p', 'yuvj422p', 'yuvj440p', 'yuvj444p',
+    'yuva420p', 'yuva422p', 'yuva444p',
+))
+
+class ChangeGate(object):
+    '''Suppress decoded frames with little change from the last emitted frame.
+
+    The change is the mean absolute difference of a tiny luma thumbnail sampled
+    by a strided view of the decoder's 8-bit Y plane before any pixel format conversion.
+    Other formats such as 10/16-bit are reformatted to a gray thumbnail instead.
+    A frame is emitted anyway if no frame has been emitted for `max_gap` secs.
+    '''
+
+    def __init__(self, threshold=0.02, size=(36, 64), max_gap=5.0):
+        '''
+        Args:
+            threshold(float): min mean absolute luma change in [0, 1] to emit
+            size(Tuple[int, int]): approximate thumbnail (H, W) to compare
+            max_gap(float): max secs without emitting a frame as a heartbeat
+        '''
+        self.threshold = threshold * 255
+        self.size = tuple(size)
+        self.max_gap = max_gap
+        self.last = None
+        self.time = None
+        self.stats = dict(
+            emitted=0,
+            suppressed=0,
+            change=0,           # last change in [0, 1]
+        )
+
+    def thumbnail(self, frame):
+        height, width = self.size
+        name = frame.format.name
+        if name in LUMA8_FORMATS:
+            plane = frame.planes[0]
+            Y = np.frombuffer(plane, np.uint8).reshape(-1, plane.line_size)[:frame.height, :frame.width]
+            return Y[::max(1, frame.height // height), ::max(1, frame.width // width)].astype(np.int16)
+        return frame.reformat(width=width, height=height, format='gray').to_ndarray().astype(np.int16)
+
+    def __call__(self, frame, timestamp):
+        '''
+        Args:
+            frame(av.VideoFrame): decoded frame
+            timestamp(float): frame time in secs
+        Returns:
+            emit(bool): whether to emit the frame
+        '''
+        thumb = self.thumbnail(frame)
+        stats = self.stats
+        if self.last is None or self.last.shape != thumb.shape or timestamp - self.time >= self.max_gap:
+            emit = True
+        else:
+            change = np.abs(thumb - self.last).mean()
+            stats['change'] = float(change / 255)
+            emit = change >= self.threshold
+        if emit:
+            self.last = thumb
+            self.time = timestamp
+            stats['emitted'] += 1
+        else:
+            stats['suppressed'] += 1
+        return emit
+
+    @classmethod
+    def create(cls, gate):
+        '''Gate from a session option of None, True for defaults or a dict of arguments.
+        '''
+        if not gate:
+            return None
+        return cls() if gate is True else cls(**gate)
+
+class MotionGrid(object):
+    '''Grid of mean motion vector magnitudes from the decoder side data without pixel conversion.
+
+    Each cell is the block area weighted mean of the vector magnitudes in pixels
+    with destinations in the cell or zero without vectors, e.g. intra coded.
+    '''
+
+    def __init__(self, grid=(9, 16)):
+        '''
+        Args:
+            grid(Tuple[int, int]): (rows, cols) of the motion grid
+        '''
+        self.grid = tuple(grid)
+
+    def setup(self, codec):
+        '''Export motion vectors before the decoder opens.
+        '''
+        options = dict(codec.options or {})
+        flags2 = options.get('flags2', '')
+        options['flags2'] = f"{flags2}+export_mvs"
+        codec.options = options
+
+    def __call__(self, frame):
+        '''
+        Args:
+            frame(av.VideoFrame): decoded frame
+        Returns:
+            motion(np.ndarray): (rows, cols) of float32 mean magnitudes
+        '''
+        rows, cols = self.grid
+        mvs = frame.side_data.get('MOTION_VECTORS')
+        if mvs is None:
+            return np.zeros(self.grid, dtype=np.float32)
+        mvs = mvs.to_ndarray()
+        magnitude = np.hypot(mvs['motion_x'], mvs['motion_y']) / np.maximum(mvs['motion_scale'], 1)
+        area = mvs['w'].astype(np.float32) * mvs['h']
+        y = np.clip(mvs['dst_y'].astype(np.int64) * rows // frame.height, 0, rows - 1)
+        x = np.clip(mvs['dst_x'].astype(np.int64) * cols // frame.width, 0, cols - 1)
+        cells = y * cols + x
+        total = np.bincount(cells, weights=magnitude * area, minlength=rows * cols)
+        covered = np.bincount(cells, weights=area, minlength=rows * cols)
+        motion = np.divide(total, covered, out=np.zeros_like(total), where=covered > 0)
+        return motion.astype(np.float32).reshape(self.grid)
+
+    @classmethod
+    def create(cls, motion):
+        '''Motion grid from a session option of None, True for the default grid or (rows, cols).
+        '''
+        if not motion:
+            return None
+        return cls() if motion is True else cls(motion)
+
+class DecodePolicy(object):
+    '''Decode budget to select frames to emit and packets to drop before decoding.
+
+    Modes:
+        all: decode and emit every frame
+        keyframes: decode and emit key frames only
+        every_n: emit every n-th frame
+        target_fps: emit frames at most at the target FPS
+    Packets not to emit are dropped without decoding if not referenced by others or intra-only.
+    Otherwise, they are decoded without conversion.
+    '''
+
+    MODES = ('all', 'keyframes', 'every_n', 'target_fps')
+
+    def __init__(self, mode='all', n=1, target_fps=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown decode policy {mode} not in {self.MODES}")
+        if mode == 'target_fps' and not target_fps:
+            raise ValueError(f"target_fps is required to decode at a target FPS")
+        self.mode = mode
+        self.n = max(1, int(n))
+        self.period = target_fps and 1.0 / target_fps or 0
+        self.next = None
+        self.codec = 'h264'
+        self.intra = False
+        self.stats = dict(
+            decoded=0,      # packets decoded
+            dropped=0,      # packets dropped before decoding
+            skipped=0,      # frames decoded but not emitted
+        )
+
+    def setup(self, codec):
+        self.codec = codec.name
+        self.intra = codec.name in INTRA_CODECS
+        if self.mode == 'keyframes':
+            codec.skip_frame = 'NONKEY'
+
+    def __call__(self, pkt, count, timestamp, annexb=False):
+        '''
+        Args:
+            pkt(av.Packet): packet to decode
+            count(int): frame count of the packet starting from 1
+            timestamp(float): frame time in seconds
+            annexb(bool): whether the packet is in Annex B to inspect NALU references
+        Returns:
+            decode(bool): whether to decode the packet
+            emit(bool): whether to emit the decoded frame
+        '''
+        mode = self.mode
+        if mode == 'all':
+            emit = True
+        elif mode == 'keyframes':
+            emit = pkt.is_keyframe
+        elif mode == 'every_n':
+            emit = (count - 1) % self.n == 0
+        else:
+            emit = self.next is None or timestamp >= self.next - 1e-6
+            if emit:
+                if self.next is None or timestamp - self.next >= self.period:
+                    # resync if falling behind
+                    self.next = timestamp
+                self.next += self.period
+
+        decode = emit or pkt.is_keyframe and not self.intra
+        if not decode and mode != 'keyframes' and not self.intra:
+            # XXX references unknown in AVCC
+            decode = not annexb or is_reference(pkt, self.codec)
+
+        stats = self.stats
+        if decode:
+            stats['decoded'] += 1
+            stats['skipped'] += not emit
+        else:
+            stats['dropped'] += 1
+        return decode, emit
@@ -6,13 +6,14 @@ from ml import logging
 
 from .avsource import AVSource, openAV
 
-def yt_hls_url(url, *args, file_name='video.h264', **kwargs):
+def yt_hls_url(url, *args, file_name='video.h264', transcode=True, **kwargs):
     """
-    Get hls url if live stream else download video and transcode
+    Get hls url if live stream else download and transcode or the video url to stream AVCC packets converted in process
     params: 
         url - youtube url to download video from
-        start - start video from this timestamp(00:00:15)
-        end - end video after this timestamp(00:00:10)
+        transcode - download and transcode to 720p/15fps h264 in Annex B by ffmpeg or stream the video url as is if False
+        start - start video from this timestamp(00:00:15) to transcode
+        end - end video after this timestamp(00:00:10) to transcode
     Returns:
         video path or url(str)
     """
@@ -20,6 +21,7 @@ def yt_hls_url(url, *args, file_name='video.h264', **kwargs):
     start = kwargs.pop('start', None)
     # NOTE: enforce 5 min limit on non-live youtube videos
     end = kwargs.pop('end', None)
+    trimming = bool(start or end)
     if not end:
         end = '00:05:00'
     try:
@@ -28,8 +30,13 @@ def yt_hls_url(url, *args, file_name='video.h264', **kwargs):
             .stdout.decode('utf-8') \
             .strip()
         if not res:
-            logging.warning(f"video is not live --> transcode to h264 and stream")
             url = subprocess.run(['youtube-dl','-f', 'best', '-g', url], stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
+            if not transcode:
+                if trimming:
+                    logging.warning(f"start={start}/end={end} ignored without transcoding")
+                logging.info(f"video is not live --> stream the video url")
+                return url
+            logging.warning(f"video is not live --> transcode to h264 and stream")
             cmd = f'ffmpeg '
             if start:
                 cmd += f'-ss {start} '
@@ -69,7 +76,8 @@ class YTSource(AVSource):
     def open(self, *args, **kwargs):
         try:
             if not self.path:
-                self.path = yt_hls_url(self.url, *args, **kwargs)
+                transcode = kwargs.pop('transcode', True)
+                self.path = yt_hls_url(self.url, *args, transcode=transcode, **kwargs)
             session = openAV(self.path, *args, **kwargs)
         except Exception as e:
             logging.error(f"Failed to open {self.url}: {e}")
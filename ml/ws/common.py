@@ -1,7 +1,7 @@
 import time
 import asyncio
 from functools import wraps
-from threading import Event
+from threading import Event, Lock
 from collections import deque
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
@@ -151,16 +151,57 @@ class ParallelExecutor:
         return iter(self.tasks)
 
 class Dequeue(deque):
-    def __init__(self, maxlen):
+    def __init__(self, maxlen, evictable=None):
+        """
+        Params:
+            maxlen: max number of elems to queue
+            evictable: predicate of elems to evict when full or any by default
+        """
         super().__init__(maxlen=maxlen)
         self.not_empty = Event()
+        self.lock = Lock()
+        self.evictable = evictable
+
+    def evict(self):
+        """
+        Evict the oldest evictable elem if full.
+        Returns:
+            whether there is room for another elem
+        """
+        if self.maxlen is None or len(self) < self.maxlen:
+            return True
+        for i, elem in enumerate(self):
+            if self.evictable is None or self.evictable(elem):
+                del self[i]
+                return True
+        return False
 
     def put(self, elem):
         """
-        Append elem to the left of deque
+        Append elem to the right of deque evicting the oldest evictable elem if full
+        """
+        with self.lock:
+            # The bounded deque evicts the leftmost elem if none is evictable
+            self.evict()
+            super().append(elem)
+            self.not_empty.set()
+
+    def putleft(self, elem):
+        """
+        Prepend elem to get next.
+        A bounded deque would evict the newest elem on the right to prepend,
+        while elem to put back is older than all the queued ones to drop first if full.
+        An elem not evictable such as EOS/ERROR evicts the oldest evictable elem instead.
+        Returns:
+            whether elem is prepended
         """
-        super().append(elem)
-        self.not_empty.set()
+        with self.lock:
+            if self.maxlen is not None and len(self) >= self.maxlen:
+                if self.evictable is None or self.evictable(elem) or not self.evict():
+                    return False
+            super().appendleft(elem)
+            self.not_empty.set()
+            return True
 
     def get(self, timeout=None):
         """
@@ -170,6 +211,7 @@ class Dequeue(deque):
         valid = self.not_empty.wait(timeout=timeout)  
         if not valid:
             raise TimeoutError('Timeout while waiting')
-        if not (len(self) - 1):
-            self.not_empty.clear()
-        return super().popleft()
\ No newline at end of file
+        with self.lock:
+            if not (len(self) - 1):
+                self.not_empty.clear()
+            return super().popleft()
\ No newline at end of file
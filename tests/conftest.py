@@ -5,3 +5,6 @@ def pytest_addoption(parser):
         "--inf", action="store_true", help="Infinite live playback or not"
     )
 
+    parser.addoption(
+        "--video", action="store", default=None, help="Local video file to benchmark decoding, e.g. 1-hour 1080p H.264"
+    )
@@ -87,4 +87,451 @@ def test_webcam(src=0):
             assert False, f"Unknown media {m}"
         
         if count == total:
-            break
\ No newline at end of file
+            break
+@pytest.mark.essential
+@pytest.mark.parametrize("decoding", [False, True])
+def test_prefetch(video_mp4, decoding, total=10):
+    src = AVSource.create(video_mp4)
+    expected = []
+    session = src.open(decoding=decoding)
+    for i in range(total):
+        m, media, frame = src.read(session, media='video')
+        expected.append((media['count'], media['duration'], media['keyframe'], media['time'] - session['start']))
+    src.close(session)
+
+    actual = []
+    session = src.open(decoding=decoding, prefetch=4)
+    for i in range(total):
+        m, media, frame = src.read(session, media='video')
+        assert media is session['video']
+        actual.append((media['count'], media['duration'], media['keyframe'], media['time'] - session['start']))
+    stats = session['video']['stats']['prefetch']
+    src.close(session)
+
+    print()
+    print('prefetch:', stats)
+    assert stats['frames'] == total
+    assert stats['max_depth'] <= 4
+    assert actual == expected
+
+@pytest.mark.essential
+def test_prefetch_pool(video_mp4, prefetch=4, total=11):
+    import numpy as np
+    src = AVSource.create(video_mp4)
+    with pytest.raises(ValueError):
+        src.open(decoding=True, prefetch=prefetch, pool=prefetch + 1)
+
+    session = src.open(decoding=True)
+    expected = [src.read(session, media='video')[-1] for _ in range(total)]
+    src.close(session)
+
+    # Frames kept until read are not overwritten by prefetching
+    session = src.open(decoding=True, prefetch=prefetch, pool=prefetch + 2)
+    for i in range(total):
+        m, media, frame = src.read(session, media='video')
+        assert np.array_equal(frame, expected[i])
+    src.close(session)
+
+@pytest.mark.essential
+@pytest.mark.parametrize("format", ['BGR', 'RGB', 'GRAY'])
+def test_pixel_format(video_mp4, format, pool=2):
+    src = AVSource.create(video_mp4)
+    session = src.open(decoding=True, pool=pool)
+    video = session['video']
+    frames = []
+    for i in range(pool + 1):
+        m, media, frame = src.read(session, media='video', format=format)
+        assert frame.flags.c_contiguous
+        assert frame.shape[:2] == (video['height'], video['width'])
+        assert frame.ndim == (2 if format == 'GRAY' else 3)
+        frames.append(frame)
+    src.close(session)
+    assert frames[0] is frames[pool]
+
+@pytest.mark.essential
+@pytest.mark.parametrize("scale, roi, shape", [
+    ((360, 640), None, (360, 640)),
+    (None, (100, 50, 640, 480), (480, 640)),
+    ((240, 320), (100, 50, 640, 480), (240, 320)),
+    # Clamped to the frame edge
+    (None, (1000, 600, 640, 480), (120, 280)),
+])
+def test_scale_roi(video_mp4, scale, roi, shape):
+    from ml import av
+    src = AVSource.create(video_mp4)
+    session = src.open(decoding=True, scale=scale, roi=roi)
+    assert src.get(session, av.VIDEO_IO_FLAGS.CAP_PROP_FRAME_HEIGHT) == shape[0]
+    assert src.get(session, av.VIDEO_IO_FLAGS.CAP_PROP_FRAME_WIDTH) == shape[1]
+    for i in range(3):
+        m, media, frame = src.read(session, media='video')
+        assert frame.shape == (*shape, 3)
+        assert (media['height'], media['width']) == shape
+    src.close(session)
+
+@pytest.mark.essential
+def test_roi_clamped():
+    import numpy as np
+    from ml import av
+    from ml.streaming.video import Converter
+    frame = av.VideoFrame.from_ndarray(np.zeros((240, 320, 3), dtype=np.uint8), format='bgr24').reformat(format='yuv420p')
+    converter = Converter(roi=(100, 50, 640, 480))
+    assert converter.geometry(frame.width, frame.height) == (220, 190)
+    assert converter(frame, 'BGR').shape == (190, 220, 3)
+    with pytest.raises(ValueError):
+        Converter(roi=(320, 0, 64, 64))(frame, 'BGR')
+
+@pytest.mark.essential
+@pytest.mark.parametrize("decode, kwargs", [
+    ('keyframes', {}),
+    ('every_n', dict(every=3)),
+    ('target_fps', dict(target_fps=2)),
+])
+def test_decode_policy(bitstream, decode, kwargs, total=3):
+    import math
+    src = AVSource.create(bitstream)
+    session = src.open(decoding=True, decode=decode, **kwargs)
+    video = session['video']
+    fps = video['fps']
+    counts = []
+    times = []
+    for i in range(total):
+        m, media, frame = src.read(session, media='video')
+        counts.append(media['count'])
+        times.append(media['time'])
+        if decode == 'keyframes':
+            assert media['keyframe']
+    stats = video['stats']['decode']
+    src.close(session)
+
+    print()
+    print(f"{decode}: counts={counts}, stats={stats}")
+    for i in range(1, total):
+        # time advances with skipped frames
+        assert math.isclose(times[i] - times[i-1], (counts[i] - counts[i-1]) / fps, rel_tol=1e-5)
+    if decode == 'every_n':
+        assert counts == [1, 4, 7]
+    elif decode == 'target_fps':
+        assert all(round((counts[i] - counts[i-1]) * 2 / fps) == 1 for i in range(1, total))
+    assert stats['decoded'] + stats['dropped'] >= counts[-1]
+
+@pytest.mark.essential
+@pytest.mark.parametrize("sessions", [1, 4])
+def test_async(video_mp4, sessions, total=5):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    src = AVSource.create(video_mp4)
+    src.executor = ThreadPoolExecutor(max_workers=sessions)
+
+    async def stream(i):
+        session = await src.aopen(decoding=True)
+        counts = []
+        async for m, media, frame in src.aiter(session):
+            assert frame.shape == (media['height'], media['width'], 3)
+            counts.append(media['count'])
+            if len(counts) == total:
+                break
+        await src.aclose(session)
+        return counts
+
+    async def main():
+        ticks = 0
+        async def tick():
+            # The event loop is not blocked by reading
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.001)
+                ticks += 1
+        ticker = asyncio.create_task(tick())
+        res = await asyncio.gather(*[stream(i) for i in range(sessions)])
+        ticker.cancel()
+        return res, ticks
+
+    res, ticks = asyncio.run(main())
+    src.executor.shutdown()
+    print()
+    print(f"{sessions} async sessions with {ticks} loop ticks")
+    assert ticks > 0
+    assert all(counts == list(range(1, total + 1)) for counts in res)
+
+@pytest.mark.essential
+def test_stream_params(video_mp4):
+    from ml import av
+    from ml.streaming.avsource import stream_params, match_params, FAST_PROBING
+    with av.open(video_mp4) as source:
+        video0 = source.streams.video[0]
+        params = stream_params(video0, 30.0)
+        assert params['codec'] == video0.codec_context.name
+        assert (params['width'], params['height']) == (video0.width, video0.height)
+        assert match_params(video0, params)
+        assert not match_params(video0, dict(params, width=params['width'] * 2))
+        assert not match_params(video0, dict(params, codec='mjpeg'))
+
+    # Minimal probing is consistent with the cached parameters
+    with av.open(video_mp4, options=FAST_PROBING) as source:
+        assert match_params(source.streams.video[0], params)
+
+@pytest.mark.essential
+@pytest.mark.parametrize("replay", ['realtime', 4, 'max'])
+def test_replay(video_mp4, replay, total=30):
+    import time
+    import math
+    src = AVSource.create(video_mp4)
+    session = src.open(decoding=False, replay=replay)
+    video = session['video']
+    fps = video['fps']
+    start = time.time()
+    times = []
+    for i in range(total):
+        m, media, frame = src.read(session, media='video')
+        times.append(media['time'])
+    elapse = time.time() - start
+    src.close(session)
+
+    print()
+    print(f"replay={replay}: {total} frames in {elapse:.3f}s")
+    # Frame time is nominal regardless of the replay speed
+    for i in range(1, total):
+        assert math.isclose(times[i] - times[i-1], 1 / fps, rel_tol=1e-5)
+    nominal = (total - 1) / fps
+    if replay == 'max':
+        assert elapse < nominal / 4
+    else:
+        speed = 1 if replay == 'realtime' else replay
+        assert elapse >= nominal / speed * 0.9
+        assert elapse < nominal / speed + 0.5
+
+@pytest.mark.essential
+@pytest.mark.parametrize("format, prefetch", [('BGR', 0), ('GRAY', 0), ('BGR', 4)])
+def test_read_batch(video_mp4, format, prefetch, n=8, batches=3):
+    import numpy as np
+    src = AVSource.create(video_mp4)
+    session = src.open(decoding=True, replay='max')
+    expected = [src.read(session, media='video', format=format)[2] for _ in range(n * batches)]
+    src.close(session)
+
+    session = src.open(decoding=True, replay='max', prefetch=prefetch)
+    video = session['video']
+    shape = (n, video['height'], video['width']) + (() if format == 'GRAY' else (3,))
+    out = np.empty(shape, dtype=np.uint8)
+    counts = []
+    for i in range(batches):
+        frames, meta = src.read_batch(session, n, out=out if i == 0 else None, format=format)
+        assert frames.shape == shape and frames.flags.c_contiguous
+        assert i > 0 or frames.base is out or frames is out
+        assert all(np.array_equal(frame, ref) for frame, ref in zip(frames, expected[i * n:(i + 1) * n]))
+        assert np.all(np.diff(meta['time']) > 0)
+        counts.extend(meta['count'].tolist())
+    src.close(session)
+    assert counts == list(range(1, n * batches + 1))
+
+@pytest.mark.essential
+@pytest.mark.parametrize("format", ['yuv420p', 'yuv420p10le', 'gray16le', 'rgb24'])
+def test_change_gate(format):
+    import numpy as np
+    from ml import av
+    from ml.streaming.video import ChangeGate
+    rng = np.random.default_rng(0)
+    # Blocky to survive downsampling
+    static = rng.integers(0, 256, (9, 16, 3), dtype=np.uint8).repeat(40, axis=0).repeat(40, axis=1)
+    changed = 255 - static
+    frame = lambda image: av.VideoFrame.from_ndarray(image, format='rgb24').reformat(format=format)
+    gate = ChangeGate(threshold=0.05, max_gap=1.0)
+    emits = [gate(frame(static), t / 10) for t in range(15)]
+    # first frame and the heartbeat after max_gap
+    assert emits == [True] + [False] * 9 + [True] + [False] * 4
+    assert gate(frame(changed), 1.5)
+    assert gate.stats['emitted'] == 3 and gate.stats['suppressed'] == 13
+    # Luma thumbnail regardless of the bit depth and range
+    reference = ChangeGate().thumbnail(av.VideoFrame.from_ndarray(static, format='rgb24').reformat(format='gray'))
+    assert np.corrcoef(gate.thumbnail(frame(static)).ravel(), reference.ravel())[0, 1] > 0.95
+
+@pytest.mark.essential
+def test_gate(video_mp4, total=5, max_gap=0.5):
+    src = AVSource.create(video_mp4)
+    session = src.open(decoding=True, replay='max', gate=dict(threshold=1.0, max_gap=max_gap))
+    video = session['video']
+    times = []
+    for i in range(total):
+        m, media, frame = src.read(session, media='video')
+        times.append(media['time'])
+    stats = video['stats']['gate']
+    src.close(session)
+    print()
+    print('gate:', stats)
+    # Only heartbeats out of unreachable change
+    for i in range(1, total):
+        assert times[i] - times[i-1] == pytest.approx(max_gap, abs=1.5 / video['fps'])
+    assert stats['emitted'] == total
+    assert stats['suppressed'] > 0
+
+@pytest.mark.essential
+@pytest.mark.parametrize("grid", [(9, 16), (3, 4)])
+def test_motion(video_mp4, grid, total=10):
+    from ml import av
+    src = AVSource.create(video_mp4)
+    session = src.open(decoding=True, motion=grid)
+    motions = []
+    for i in range(total):
+        m, media, frame = src.read(session, media='video', format=None)
+        assert isinstance(frame, av.VideoFrame)
+        assert media['motion'].shape == grid
+        motions.append(media['motion'].mean())
+    src.close(session)
+    print()
+    print(f"motion{grid}:", [f"{m:.2f}" for m in motions])
+    assert all(m >= 0 for m in motions)
+
+@pytest.mark.essential
+def test_packet_ring(gop=10, fps=10):
+    from ml import av
+    from ml.streaming.ring import PacketRing
+    ring = PacketRing(seconds=2, size=60 * 1024)
+    for i in range(100):
+        ring.append(i / fps, av.Packet(1024), i % gop == 0)
+        assert ring.packets[0][1]
+        assert ring.stats['bytes'] <= ring.size
+    # Covering 2s at least from a key frame
+    assert ring.stats['seconds'] >= 2 - 1 / fps
+    assert ring.stats['bytes'] == ring.stats['packets'] * 1024
+    clip = ring.clip(9.25, 9.55)
+    assert clip[0][0] == 9.0 and clip[0][1] and clip[-1][0] == 9.5
+
+    # Bounded by bytes
+    ring = PacketRing(seconds=10, size=15 * 1024)
+    for i in range(100):
+        ring.append(i / fps, av.Packet(1024), i % gop == 0)
+    assert ring.stats['max_bytes'] <= 15 * 1024 and ring.packets[0][1]
+
+@pytest.mark.essential
+@pytest.mark.parametrize("decoding, ext", [(False, 'mp4'), (False, 'mkv'), (True, 'mkv')])
+def test_export_clip(video_mp4, tmp_path, decoding, ext, total=45):
+    from ml import av
+    src = AVSource.create(video_mp4)
+    session = src.open(decoding=decoding, replay='max', ring=dict(seconds=1))
+    video = session['video']
+    times = []
+    for i in range(total):
+        m, media, frame = src.read(session, media='video')
+        times.append(media['time'])
+    stats = dict(video['stats']['ring'])
+    path = tmp_path / f"clip.{ext}"
+    duration = src.export_clip(session, times[-10], times[-2], path)
+    src.close(session)
+
+    print()
+    print('ring:', stats)
+    assert stats['bytes'] > 0 and stats['seconds'] >= 1 - 1 / video['fps']
+    with av.open(str(path)) as clip:
+        packets = [pkt for pkt in clip.demux(video=0) if pkt.size > 0]
+    with av.open(str(path)) as clip:
+        frames = list(clip.decode(video=0))
+    # Length prefixed samples under avcC with sync flags
+    assert packets[0].is_keyframe
+    assert not any(bytes(pkt)[:4] == b'\0\0\0\1' for pkt in packets)
+    assert frames[0].key_frame
+    assert len(frames) >= 9
+    assert duration >= times[-2] - times[-10]
+
+@pytest.mark.essential
+@pytest.mark.parametrize("decoding", [False, True])
+def test_snapshot(video_mp4, decoding, total=45):
+    import time
+    import numpy as np
+    src = AVSource.create(video_mp4)
+    session = src.open(decoding=decoding, replay='max', snapshots=dict(seconds=2))
+    assert src.snapshot(session) is None
+    keyframes = []
+    for i in range(total):
+        m, media, frame = src.read(session, media='video')
+        if media['keyframe']:
+            keyframes.append(media['time'])
+    t, jpeg = src.snapshot(session)
+    assert t == keyframes[-1]
+    assert jpeg[:2] == b'\xff\xd8'
+
+    # Cached until the next key frame
+    t0 = time.time()
+    assert src.snapshot(session)[1] is jpeg
+    elapsed = time.time() - t0
+    _, png = src.snapshot(session, format='png', size=(90, 160))
+    assert png[:4] == b'\x89PNG'
+    _, bgr = src.snapshot(session, format='BGR', size=(90, 160))
+    assert isinstance(bgr, np.ndarray) and bgr.shape == (90, 160, 3)
+    t, _ = src.snapshot(session, t=keyframes[-1] - 0.01)
+    assert t < keyframes[-1]
+    src.close(session)
+    print()
+    print(f"cached snapshot in {elapsed * 1000:.3f}ms")
+
+@pytest.mark.essential
+def test_avcc_passthrough(video_mp4, total=45):
+    from ml import av
+    from ml.streaming.nalu import scan_nalus
+    from ml.av import NALU_t
+    src = AVSource.create(video_mp4)
+    session = src.open(decoding=False, replay='max')
+    assert session['video']['avcc'] is not None
+    # Annex B decodable without out of band extradata
+    decoder = av.CodecContext.create('h264', 'r')
+    decoded = 0
+    for i in range(total):
+        m, media, pkt = src.read(session, media='video')
+        assert bytes(pkt)[:4] == b'\x00\x00\x00\x01'
+        if media['keyframe']:
+            types = scan_nalus(pkt)['type'].tolist()
+            assert NALU_t.SPS in types and NALU_t.PPS in types
+        decoded += len(decoder.decode(pkt))
+    src.close(session)
+    decoded += len(decoder.decode(None))
+    assert decoded == total
+
+@pytest.fixture
+def video_hevc(tmp_path, frames=45, gop=15):
+    from ml import av
+    import numpy as np
+    path = tmp_path / 'hevc.mp4'
+    with av.open(str(path), 'w') as output:
+        stream = output.add_stream('libx265', rate=15)
+        stream.width, stream.height = 320, 240
+        stream.pix_fmt = 'yuv420p'
+        stream.options = {'x265-params': f"log-level=none:keyint={gop}:bframes=0"}
+        for i in range(frames):
+            img = np.full((240, 320, 3), (i * 5) % 256, dtype=np.uint8)
+            output.mux(stream.encode(av.VideoFrame.from_ndarray(img, format='rgb24')))
+        output.mux(stream.encode(None))
+    return str(path)
+
+@pytest.mark.essential
+@pytest.mark.parametrize("ext", ['mp4', 'hevc'])
+def test_hevc_passthrough(video_hevc, ext, total=45):
+    from ml import av
+    from ml.streaming.nalu import scan_nalus, HEVC_NALU_t
+    if ext == 'hevc':
+        # Annex B bitstream
+        path = video_hevc.replace('.mp4', '.hevc')
+        with av.open(video_hevc) as source, av.open(path, 'w') as output:
+            stream = output.add_stream(template=source.streams.video[0])
+            for pkt in source.demux(video=0):
+                if pkt.size > 0:
+                    pkt.stream = stream
+                    output.mux(pkt)
+        video_hevc = path
+    src = AVSource.create(video_hevc)
+    session = src.open(decoding=False, replay='max')
+    assert session['video']['codec'].name == 'hevc'
+    decoder = av.CodecContext.create('hevc', 'r')
+    decoded = 0
+    for i in range(total):
+        res = src.read(session, media='video')
+        if res is None:
+            break
+        m, media, pkt = res
+        nalus = scan_nalus(pkt, codec='hevc')
+        types = nalus['type'].tolist()
+        assert nalus['pos'][0] == 0
+        if media['keyframe']:
+            assert {HEVC_NALU_t.VPS, HEVC_NALU_t.SPS, HEVC_NALU_t.PPS} <= set(types)
+        decoded += len(decoder.decode(pkt))
+    src.close(session)
+    decoded += len(decoder.decode(None))
+    assert decoded == i + 1
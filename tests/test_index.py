@@ -0,0 +1,72 @@
+import shutil
+import pytest
+
+from ml.streaming import AVSource
+from ml.streaming.index import build_index, load_index, index_path
+from ml import logging
+
+from fixtures import assets
+
+@pytest.fixture(params=['video_mp4', 'bitstream_short'])
+def video(request, tmp_path):
+    # Copy to build the sidecar index next to
+    path = getattr(assets, request.param).path
+    video = tmp_path / path.name
+    shutil.copy(path, video)
+    return video
+
+@pytest.mark.essential
+def test_keyframe_index(video):
+    index = build_index(video)
+    assert len(index) > 0 and index.count[0] == 0 and index.time[0] == 0
+    assert (index.time[1:] > index.time[:-1]).all()
+    assert sum(end - start for start, end in index.gops()) == index.frames
+
+    assert not index_path(video).exists()
+    loaded = load_index(video)
+    assert index_path(video).exists()
+    assert loaded.time.tolist() == index.time.tolist()
+    assert loaded.count.tolist() == index.count.tolist()
+    assert loaded.pts == index.pts
+    assert index.locate(index.time[-1] + 1) == len(index) - 1
+    assert index.locate((index.time[0] + index.time[1]) / 2) == 0
+    assert index.locate((index.count[1] + 0.5) / 10, fps=10) == 1
+
+@pytest.mark.essential
+def test_seek(video):
+    index = load_index(video)
+    src = AVSource.create(str(video))
+    session = src.open(decoding=True, replay='max')
+    start = session['start']
+    fps = session['video']['fps']
+    t = (index.count[-2] + index.count[-1]) / 2 / fps
+    ktime = src.seek(session, t)
+    assert ktime == pytest.approx(index.count[-2] / fps)
+    m, media, frame = src.read(session, media='video')
+    assert media['keyframe']
+    assert media['count'] == index.count[-2] + 1
+    assert media['time'] == pytest.approx(start + ktime)
+    src.close(session)
+
+@pytest.mark.essential
+def test_open_start_end(video):
+    index = load_index(video)
+    src = AVSource.create(str(video))
+    session = src.open(decoding=False, replay='max')
+    # Key frames timed by packet count at the session FPS
+    fps = session['video']['fps']
+    src.close(session)
+    start, end = index.count[1] / fps + 0.01, index.count[2] / fps
+    session = src.open(decoding=False, replay='max', start=start, end=end)
+    counts = []
+    while True:
+        res = src.read(session, media='video')
+        if res is None:
+            break
+        counts.append(res[1]['count'])
+    src.close(session)
+    logging.info(f"Read frames[{counts[0]}:{counts[-1]}] for [{start:.3f}, {end:.3f})")
+    assert counts[0] == index.count[1] + 1
+    assert counts == list(range(counts[0], counts[-1] + 1))
+    # Nominal frame time may round up to one frame off the next key frame
+    assert abs(len(counts) - (index.count[2] - index.count[1])) <= 1
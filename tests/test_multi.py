@@ -0,0 +1,63 @@
+import pytest
+
+from ml.streaming import AVSource, MultiSourceReader
+from ml import logging
+
+from fixtures import assets
+
+@pytest.fixture
+def video_mp4():
+    return assets.video_mp4.path.__str__()
+
+@pytest.mark.essential
+@pytest.mark.parametrize("sessions, workers", [(4, 2), (8, 2)])
+def test_multi_source_reader(video_mp4, sessions, workers, total=10, maxsize=2):
+    src = AVSource.create(video_mp4)
+    reader = MultiSourceReader(workers=workers, maxsize=maxsize)
+    opened = {}
+    for i in range(sessions):
+        session = src.open(decoding=True)
+        opened[reader.add(src, session)] = session
+
+    counts = {sid: [] for sid in opened}
+    for sid, m, meta, frame in reader:
+        assert m == 'video', f"session[{sid}] ended early: {frame}"
+        assert frame.shape == (meta['height'], meta['width'], 3)
+        counts[sid].append(meta['count'])
+        if len(counts[sid]) == total:
+            reader.remove(sid)
+            src.close(opened[sid])
+        if all(len(c) >= total for c in counts.values()):
+            break
+    stats = reader.stats()
+    reader.close()
+
+    print()
+    print(f"{sessions} sessions by {workers} workers:", {sid: len(c) for sid, c in counts.items()})
+    assert not stats
+    for sid, c in counts.items():
+        # frames in order per session
+        assert c[:total] == list(range(1, total + 1))
+
+@pytest.mark.essential
+def test_multi_source_reader_error():
+    import time
+    from queue import Queue
+    class Failing:
+        def read(self, session, media='video', format='BGR'):
+            raise ConnectionError('Lost connection')
+
+    class SlowQueue(Queue):
+        def put(self, item, *args, **kwargs):
+            # Widen the window between the removal and the queueing
+            time.sleep(0.3)
+            super().put(item, *args, **kwargs)
+
+    reader = MultiSourceReader(workers=1)
+    reader.frames = SlowQueue()
+    sid = reader.add(Failing(), {})
+    results = list(reader)
+    reader.close()
+    assert len(results) == 1
+    assert results[0][:3] == (sid, None, None)
+    assert isinstance(results[0][3], ConnectionError)
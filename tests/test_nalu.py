@@ -0,0 +1,218 @@
+import time
+import pytest
+import numpy as np
+
+from ml import av, logging
+from ml.av.h264 import NALU_t, NALUParser
+from ml.streaming.nalu import START_CODE, HEVC_NALU_t, scan_nalus, split_nalus, rewrite_packet, is_reference, parse_avcc, parse_hvcc, avcc_to_annexb
+from fixtures import assets
+
+RESOLUTIONS = {
+    '1080p': 250 * 1024,    # typical key frame size in bytes
+    '4K': 1024 * 1024,
+}
+
+def synthesize(size, seed=0):
+    '''Synthesize an Annex B access unit of AUD/SPS/PPS/SEI/IDR NALUs with trailing zero bytes.
+    '''
+    rng = np.random.default_rng(seed)
+    def payload(n):
+        # XXX no emulated START CODE in the payload
+        data = rng.integers(1, 256, n, dtype=np.uint8)
+        return data.tobytes()
+    nalus = [
+        b'\x00\x00\x00\x01\x09' + payload(1),
+        b'\x00\x00\x00\x01\x67' + payload(24) + b'\x00',
+        b'\x00\x00\x00\x01\x68' + payload(4) + b'\x00',
+        b'\x00\x00\x01\x06' + payload(32),
+    ]
+    slices = 4
+    for i in range(slices):
+        nalus.append(b'\x00\x00\x01\x65' + payload(size // slices))
+    return bytearray(b''.join(nalus))
+
+def synthesize_hevc(size, seed=0):
+    '''Synthesize H.265 access units of AUD/VPS/SPS/PPS/SEI/IDR and a non-reference TRAIL_N.
+    '''
+    rng = np.random.default_rng(seed)
+    def nalu(type, n):
+        return START_CODE + bytes([type << 1, 0x01]) + rng.integers(1, 256, n, dtype=np.uint8).tobytes()
+    idr = [nalu(HEVC_NALU_t.AUD, 1), nalu(HEVC_NALU_t.VPS, 20), nalu(HEVC_NALU_t.SPS, 40), nalu(HEVC_NALU_t.PPS, 6), nalu(HEVC_NALU_t.PREFIX_SEI, 32)]
+    idr += [nalu(HEVC_NALU_t.IDR_W_RADL, size // 2) for _ in range(2)]
+    trail = [nalu(HEVC_NALU_t.AUD, 1), nalu(HEVC_NALU_t.TRAIL_N, size // 8)]
+    return bytearray(b''.join(idr)), bytearray(b''.join(trail))
+
+@pytest.fixture
+def bitstream():
+    import os
+    from ml import io
+    path = assets.bitstream_workaround.path
+    size = os.path.getsize(path)
+    with io.FileIO(path, 'rb') as f:
+        buf = bytearray(size)
+        f.readinto(buf)
+        return buf
+
+@pytest.mark.essential
+@pytest.mark.parametrize("workaround", [False, True])
+def test_scan_nalus(bitstream, workaround):
+    expected = [((pos, type), bytes(nalu)) for (pos, _, _, type), nalu in NALUParser(bitstream, workaround)]
+    nalus = scan_nalus(bitstream, workaround=workaround)
+    actual = [((pos, type), bytes(nalu)) for (pos, _, _, type, _), nalu in zip(nalus.tolist(), split_nalus(bitstream, nalus))]
+    logging.info(f"Scanned {len(actual)} NALUs from {len(bitstream)} bytes")
+    assert actual == expected
+
+@pytest.mark.essential
+@pytest.mark.parametrize("resolution", list(RESOLUTIONS))
+def test_scan_nalus_synthetic(resolution):
+    au = synthesize(RESOLUTIONS[resolution])
+    nalus = scan_nalus(au, workaround=True)
+    assert nalus['type'].tolist() == [NALU_t.AUD, NALU_t.SPS, NALU_t.PPS, NALU_t.SEI] + [NALU_t.IDR] * 4
+    for nalu in split_nalus(au, nalus):
+        assert nalu[-1] != 0x00
+
+@pytest.mark.parametrize("resolution", list(RESOLUTIONS))
+def test_scan_nalus_benchmark(resolution, repeats=20):
+    au = synthesize(RESOLUTIONS[resolution])
+    pkt = memoryview(au)
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        parsed = [nalu for _, nalu in NALUParser(pkt, True)]
+    parser = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        scanned = split_nalus(pkt, scan_nalus(pkt, workaround=True))
+    scanner = time.perf_counter() - start
+
+    assert [bytes(nalu) for nalu in scanned] == [bytes(nalu) for nalu in parsed]
+    total = len(au) * repeats / 2**20
+    print()
+    print(f"{resolution} key frame of {len(au)} bytes:")
+    print(f"  NALUParser:  {total / parser:10.2f}MB/s")
+    print(f"  scan_nalus(): {total / scanner:10.2f}MB/s ({parser / scanner:.1f}x)")
+
+@pytest.mark.essential
+def test_rewrite_packet():
+    au = synthesize(RESOLUTIONS['1080p'])
+    pkt = av.Packet(au)
+    pkt.pts = pkt.dts = 3000
+    nalus = scan_nalus(pkt)
+    NALUs = split_nalus(pkt, nalus)
+    assert rewrite_packet(pkt, NALUs) is pkt
+
+    CPD = [bytes(nalu) for nalu in NALUs[1:3]]
+    kept = np.isin(nalus['type'], (NALU_t.IDR,))
+    packet = rewrite_packet(pkt, split_nalus(pkt, nalus[kept]), CPD)
+    assert packet is not pkt
+    assert packet.pts == pkt.pts and packet.dts == pkt.dts
+    assert bytes(packet) == b''.join(CPD + [bytes(nalu) for nalu in NALUs[4:]])
+
+@pytest.mark.essential
+def test_avcc_to_annexb():
+    au = synthesize(RESOLUTIONS['1080p'])
+    nalus = scan_nalus(au)
+    payloads = [bytes(au[hdr:end]) for hdr, end in zip(nalus['hdr'].tolist(), nalus['end'].tolist())]
+    sps, pps = payloads[1:3]
+    extradata = bytes([1, sps[1], sps[2], sps[3], 0xFF, 0xE1]) + len(sps).to_bytes(2, 'big') + sps + b'\x01' + len(pps).to_bytes(2, 'big') + pps
+    length_size, CPD = parse_avcc(extradata)
+    assert length_size == 4
+    assert CPD == [START_CODE + sps, START_CODE + pps]
+
+    def avcc(payloads, keyframe):
+        pkt = av.Packet(b''.join(len(payload).to_bytes(length_size, 'big') + payload for payload in payloads))
+        pkt.pts = pkt.dts = 3000
+        pkt.is_keyframe = keyframe
+        return pkt
+
+    # Out of band SPS/PPS prepended to key frames only
+    slices = [payloads[0]] + payloads[3:]
+    packet = avcc_to_annexb(avcc(slices, True), length_size, CPD)
+    assert packet.pts == 3000 and packet.dts == 3000 and packet.is_keyframe
+    assert bytes(packet) == b''.join(CPD + [START_CODE + payload for payload in slices])
+    packet = avcc_to_annexb(avcc(slices, False), length_size, CPD)
+    assert bytes(packet) == b''.join(START_CODE + payload for payload in slices)
+
+    # In band SPS/PPS kept as is
+    packet = avcc_to_annexb(avcc(payloads, True), length_size, CPD)
+    assert bytes(packet) == b''.join(START_CODE + payload for payload in payloads)
+
+@pytest.mark.essential
+def test_scan_nalus_hevc():
+    idr, trail = synthesize_hevc(RESOLUTIONS['1080p'])
+    nalus = scan_nalus(idr, codec='hevc')
+    assert nalus['type'].tolist() == [HEVC_NALU_t.AUD, HEVC_NALU_t.VPS, HEVC_NALU_t.SPS, HEVC_NALU_t.PPS, HEVC_NALU_t.PREFIX_SEI] + [HEVC_NALU_t.IDR_W_RADL] * 2
+    assert is_reference(idr, codec='hevc')
+    assert scan_nalus(trail, codec='hevc')['type'].tolist() == [HEVC_NALU_t.AUD, HEVC_NALU_t.TRAIL_N]
+    assert not is_reference(trail, codec='hevc')
+
+@pytest.mark.essential
+def test_hvcc_to_annexb():
+    idr, trail = synthesize_hevc(RESOLUTIONS['1080p'])
+    nalus = scan_nalus(idr, codec='hevc')
+    payloads = [bytes(idr[hdr:end]) for hdr, end in zip(nalus['hdr'].tolist(), nalus['end'].tolist())]
+    psets = payloads[1:4]
+    extradata = bytes([1] + [0] * 20 + [0xFC | 3, len(psets)])
+    for payload in psets:
+        extradata += bytes([0x80 | (payload[0] >> 1)]) + (1).to_bytes(2, 'big') + len(payload).to_bytes(2, 'big') + payload
+    length_size, CPD = parse_hvcc(extradata)
+    assert length_size == 4
+    assert CPD == [START_CODE + payload for payload in psets]
+
+    slices = payloads[:1] + payloads[4:]
+    pkt = av.Packet(b''.join(len(payload).to_bytes(length_size, 'big') + payload for payload in slices))
+    pkt.is_keyframe = True
+    packet = avcc_to_annexb(pkt, length_size, CPD, codec='hevc')
+    assert bytes(packet) == b''.join(CPD + [START_CODE + payload for payload in slices])
+
+    # In band VPS/SPS/PPS kept as is
+    pkt = av.Packet(b''.join(len(payload).to_bytes(length_size, 'big') + payload for payload in payloads))
+    pkt.is_keyframe = True
+    packet = avcc_to_annexb(pkt, length_size, CPD, codec='hevc')
+    assert bytes(packet) == bytes(idr)
+
+@pytest.mark.parametrize("dropping", [False, True])
+def test_rewrite_packet_benchmark(dropping, fps=30, seconds=10):
+    import tracemalloc
+    # 1080p GOP of one key frame followed by P frames
+    AUs = [synthesize(RESOLUTIONS['1080p'], seed=0)] + [synthesize(16 * 1024, seed=i) for i in range(1, fps)]
+    pkts = [av.Packet(au) for au in AUs]
+    CPD = [bytes(nalu) for nalu in split_nalus(AUs[0], scan_nalus(AUs[0]))[1:3]]
+    frames = fps * seconds
+    total = sum(pkt.size for pkt in pkts) * seconds / 2**20
+
+    def joined(pkt, NALUs, CPD=()):
+        packet = av.Packet(bytearray(b''.join(list(CPD) + NALUs)))
+        packet.dts = pkt.dts
+        packet.pts = pkt.pts
+        packet.time_base = pkt.time_base
+        return packet
+
+    def stream(rewrite):
+        for i in range(frames):
+            pkt = pkts[i % fps]
+            nalus = scan_nalus(pkt, workaround=True)
+            kept = nalus['type'] != (NALU_t.AUD if dropping else NALU_t.UNSPECIFIED)
+            yield rewrite(pkt, split_nalus(pkt, nalus[kept]), CPD if i == 0 else ())
+
+    print()
+    print(f"30 FPS 1080p stream {'dropping AUD' if dropping else 'as is'}:")
+    for name, rewrite in (('join', joined), ('rewrite_packet', rewrite_packet)):
+        start = time.perf_counter()
+        for packet in stream(rewrite):
+            pass
+        elapse = time.perf_counter() - start
+
+        # Python heap allocated per frame in transit
+        allocated = 0
+        tracemalloc.start()
+        frame = stream(rewrite)
+        for _ in range(frames):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            packet = next(frame)
+            _, peak = tracemalloc.get_traced_memory()
+            allocated += peak - current
+        tracemalloc.stop()
+        print(f"{name:>16}: {total / elapse:8.2f}MB/s, {allocated / frames / 1024:8.2f}KB/frame allocated")
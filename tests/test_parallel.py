@@ -0,0 +1,162 @@
+import sys
+import time
+import shutil
+import pytest
+import numpy as np
+
+from ml import av, logging
+from ml.streaming import AVSource
+from ml.streaming.parallel import ParallelDecoder, parallel_read
+
+from fixtures import assets
+
+@pytest.fixture
+def video_mp4(tmp_path):
+    # Copy to build the sidecar index next to
+    video = tmp_path / assets.video_mp4.path.name
+    shutil.copy(assets.video_mp4.path, video)
+    return video
+
+@pytest.fixture
+def video(request, video_mp4):
+    return request.config.getoption('--video') or video_mp4
+
+@pytest.mark.essential
+@pytest.mark.parametrize("workers, chunk", [(1, 1), (2, 1), (4, 2)])
+def test_parallel_read(video_mp4, workers, chunk):
+    with av.open(str(video_mp4)) as source:
+        expected = [frame.to_ndarray(format='bgr24') for frame in source.decode(video=0)]
+    frames = list(parallel_read(video_mp4, workers=workers, chunk=chunk, inflight=2))
+    assert [meta['count'] for meta, _ in frames] == list(range(1, len(expected) + 1))
+    times = [meta['time'] for meta, _ in frames]
+    assert times == sorted(times)
+    assert all(np.array_equal(frame, ref) for (_, frame), ref in zip(frames, expected))
+
+@pytest.mark.parametrize("workers", [1, 2, 4, 8, 16])
+def test_parallel_read_benchmark(video, workers):
+    '''Decoding throughput scaling by workers given --video or the short MP4 asset by default.
+    '''
+    # Build the index outside of timing
+    next(parallel_read(video, workers=1, inflight=1))
+    start = time.perf_counter()
+    frames = 0
+    for meta, frame in parallel_read(video, workers=workers):
+        frames += 1
+    elapse = time.perf_counter() - start
+    print()
+    print(f"{workers:2d} workers: {frames} frames in {elapse:.2f}s at {frames / elapse:.2f}FPS")
+
+def encode_mjpeg(path, frames=30, size=(360, 640), fps=30):
+    '''Synthesize an MJPEG clip of distinct frames like a webcam stream.
+    '''
+    height, width = size
+    with av.open(str(path), 'w') as output:
+        stream = output.add_stream('mjpeg', rate=fps)
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = 'yuvj420p'
+        for i in range(frames):
+            image = np.full((height, width, 3), (i * 8) % 256, dtype=np.uint8)
+            image[:, :(i + 1) * width // frames] = 255 - image[0, 0]
+            frame = av.VideoFrame.from_ndarray(image, format='bgr24')
+            for pkt in stream.encode(frame):
+                output.mux(pkt)
+        for pkt in stream.encode(None):
+            output.mux(pkt)
+    return path
+
+@pytest.fixture
+def video_mjpeg(tmp_path):
+    return encode_mjpeg(tmp_path / 'webcam.mkv')
+
+def decode_all(path, decoder=None, format='BGR'):
+    with av.open(str(path)) as source:
+        packets = [pkt for pkt in source.demux(video=0) if pkt.size > 0]
+        codec = source.streams.video[0].codec_context
+        if decoder is None:
+            return [frame.to_ndarray(format='bgr24') for pkt in packets for frame in codec.decode(pkt)]
+        decoder = decoder(codec)
+    frames = []
+    try:
+        for i, pkt in enumerate(packets):
+            decoder.submit(pkt, format, i)
+            if decoder.full:
+                frames.append(decoder.next())
+        while len(decoder) > 0:
+            frames.append(decoder.next())
+    finally:
+        decoder.close()
+    return frames
+
+@pytest.mark.essential
+@pytest.mark.parametrize("workers", [1, 2, 4])
+def test_parallel_decoder(video_mjpeg, workers):
+    expected = decode_all(video_mjpeg)
+    frames = decode_all(video_mjpeg, lambda codec: ParallelDecoder(codec, workers))
+    assert [i for _, _, i in frames] == list(range(len(expected)))
+    assert all(np.array_equal(frame, ref) for (_, frame, _), ref in zip(frames, expected))
+
+@pytest.mark.essential
+def test_parallel_decoder_roi(tmp_path, roi=(64, 32, 640, 480), workers=8):
+    from ml.streaming.video import Converter
+    video = encode_mjpeg(tmp_path / 'webcam.mkv', frames=200, size=(720, 1280))
+    converter = Converter(roi=roi)
+    with av.open(str(video)) as source:
+        expected = [converter(frame, 'BGR') for frame in source.decode(video=0)]
+    # Switch threads often to interleave workers even on few cores
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        runs = [decode_all(video, lambda codec: ParallelDecoder(codec, workers, roi=roi)) for _ in range(3)]
+    finally:
+        sys.setswitchinterval(interval)
+    for frames in runs:
+        assert [i for _, _, i in frames] == list(range(len(expected)))
+        assert all(frame.shape == (480, 640, 3) for _, frame, _ in frames)
+        assert all(np.array_equal(frame, ref) for (_, frame, _), ref in zip(frames, expected))
+
+@pytest.mark.essential
+def test_parallel_mjpeg(video_mjpeg):
+    src = AVSource.create(str(video_mjpeg))
+    results = []
+    for decoders in (1, 3):
+        session = src.open(decoding=True, replay='max', decoders=decoders, decode='every_n', every=2, scale=(90, 160))
+        assert (session['video']['decoder'] is not None) == (decoders > 1)
+        frames = []
+        while True:
+            res = src.read(session, media='video')
+            if res is None:
+                break
+            _, meta, frame = res
+            frames.append((meta['count'], meta['width'], meta['height'], frame.copy()))
+        results.append((frames, dict(session['video']['stats']['decode'])))
+        src.close(session)
+    (serial, stats), (parallel, pstats) = results
+    assert stats == pstats and stats['decoded'] == len(serial)
+    assert [frame[:3] for frame in serial] == [frame[:3] for frame in parallel]
+    assert all(np.array_equal(frame[3], ref[3]) for frame, ref in zip(parallel, serial))
+
+@pytest.mark.essential
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_parallel_seek(video_mjpeg, prefetch):
+    src = AVSource.create(str(video_mjpeg))
+    session = src.open(decoding=True, decoders=3, prefetch=prefetch)
+    frames = [src.read(session, media='video')[2].copy() for _ in range(20)]
+    src.seek(session, 0.0)
+    assert len(session['video']['decoder']) == 0
+    for i in range(3):
+        _, meta, frame = src.read(session, media='video')
+        assert meta['count'] == i + 1
+        assert np.array_equal(frame, frames[i])
+    src.close(session)
+
+@pytest.mark.parametrize("workers", [1, 2, 4, 8])
+def test_parallel_decoder_benchmark(tmp_path, workers):
+    '''MJPEG decoding throughput scaling by threads at 1080p.
+    '''
+    video = encode_mjpeg(tmp_path / 'webcam.mkv', frames=120, size=(1080, 1920))
+    start = time.perf_counter()
+    frames = len(decode_all(video, lambda codec: ParallelDecoder(codec, workers)))
+    elapse = time.perf_counter() - start
+    print()
+    print(f"{workers:2d} threads: {frames} frames in {elapse:.2f}s at {frames / elapse:.2f}FPS")
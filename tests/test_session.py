@@ -0,0 +1,61 @@
+import sys
+import time
+import pickle
+import pytest
+
+from ml.streaming.session import Session, VideoState, AudioState
+
+@pytest.mark.essential
+def test_state_mapping():
+    video = VideoState(count=0, time=0, prev=None)
+    assert video['count'] == video.count == 0
+    video['count'] += 1
+    video.time = 1.5
+    assert dict(video) == dict(time=1.5, count=1, prev=None)
+    assert 'prev' in video and 'width' not in video
+    assert video.get('width', 640) == 640
+    with pytest.raises(KeyError):
+        video['width']
+
+    # Unknown keys go to the extra dict
+    video['custom'] = 'extra'
+    assert video['custom'] == 'extra' and len(video) == 4
+    assert list(video) == ['count', 'time', 'prev', 'custom']
+    video.update(width=640, height=360)
+    assert video.setdefault('height', 720) == 360
+    del video['custom']
+    assert video.pop('width') == 640 and 'width' not in video
+
+    # Shallow copies of the same type
+    shadow = video.copy()
+    assert type(shadow) is VideoState and shadow == video and shadow is not video
+    shadow.count += 1
+    assert video.count == 1
+    assert pickle.loads(pickle.dumps(video)) == video
+
+    session = Session(src='rtsp://camera', start=0, video=video, audio=AudioState(count=0))
+    assert session['video'] is session.video
+    assert session.get('origin', session['start']) == 0
+    session.clear()
+    assert len(session) == 0 and dict(session) == {}
+
+@pytest.mark.parametrize("cls", [dict, VideoState])
+def test_state_benchmark(cls, n=100000):
+    '''Per-frame reads and writes by keys and attributes with the memory per state.
+    '''
+    fields = dict(dict.fromkeys(VideoState.ORDER), count=0, time=0.0, duration=0.033)
+    state = cls(**fields)
+    start = time.perf_counter()
+    for _ in range(n):
+        state['count'] += 1
+        state['time'] = state['time'] + state['duration']
+    keyed = time.perf_counter() - start
+    attributed = None
+    if cls is not dict:
+        start = time.perf_counter()
+        for _ in range(n):
+            state.count += 1
+            state.time = state.time + state.duration
+        attributed = time.perf_counter() - start
+    print()
+    print(f"{cls.__name__}: {sys.getsizeof(state)} bytes, keys {keyed / n * 1e9:.0f}ns" + (attributed and f", attributes {attributed / n * 1e9:.0f}ns" or ''))
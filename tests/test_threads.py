@@ -0,0 +1,44 @@
+import pytest
+
+from ml import av
+from ml.streaming.threads import DecodeThreads, configure
+
+def decoder(name='h264'):
+    return av.CodecContext.create(name, 'r')
+
+@pytest.mark.essential
+def test_decode_threads():
+    budget = DecodeThreads(threads=8)
+    hd = budget.register(decoder(), 1920, 1080, 30)
+    allocation = budget.allocation()
+    assert allocation[hd]['threads'] == 8 and allocation[hd]['applied'] == 8
+    assert allocation[hd]['type'] == 'SLICE'
+
+    # Rebalanced by pixel rate with at least one thread per session
+    sd = budget.register(decoder(), 640, 360, 30)
+    qhd = budget.register(decoder(), 1280, 720, 15)
+    allocation = budget.allocation()
+    assert sum(session['threads'] for session in allocation.values()) == 8
+    assert allocation[sd]['threads'] == 1
+    assert allocation[hd]['threads'] > allocation[qhd]['threads'] > 1
+    assert budget.stale(hd) and not budget.stale(sd)
+
+    # Oversubscribed with one thread each
+    keys = [budget.register(decoder(), 1920, 1080, 30) for _ in range(8)]
+    assert all(session['threads'] == 1 for session in budget.allocation().values())
+    for key in keys + [sd, qhd]:
+        budget.unregister(key)
+    assert budget.allocation()[hd]['threads'] == 8
+
+    budget.resize(2)
+    assert budget.allocation()[hd]['threads'] == 2
+    budget.unregister(hd)
+    assert budget.allocation() == {}
+
+@pytest.mark.essential
+def test_configure_frame_threads():
+    codec = decoder()
+    assert configure(codec, 4, delay=True)
+    assert codec.thread_count == 4 and codec.thread_type == 'FRAME'
+    assert configure(codec, 1, delay=True)
+    assert codec.thread_type == 'SLICE'